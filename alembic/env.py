@@ -10,7 +10,7 @@ from tgbot.config import load_config
 
 from tgbot.database.models.models import Forms, Departments, \
     FormsDepartments, SelfAssessment, Universities, WorkedCompanies, Trips, Languages, Applications, Users, Salaries, \
-    Fines, Bonuses, Tasks, Appreciations, Complaints
+    Fines, Bonuses, Tasks, Appreciations, Complaints, BroadcastJobs, PayrollRollups, TRIGRAM_INDEX
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -31,6 +31,12 @@ db_config = load_config().db
 target_metadata = metadata
 config.set_main_option("sqlalchemy.url", str(db_config.construct_sqlalchemy_url()) + "?async_fallback=True")
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # The trigram index exists only where pg_trgm is available, so it isn't in the metadata
+    return not (type_ == "index" and name == TRIGRAM_INDEX)
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -53,6 +59,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -76,7 +83,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
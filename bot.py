@@ -2,7 +2,6 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher, Router
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from tgbot.config import load_config, Config
 from tgbot.handlers.superuser import superuser_router
@@ -11,18 +10,29 @@ from tgbot.handlers.echo import echo_router
 from tgbot.handlers.new_user import new_user_router
 from tgbot.middlewares.config import ConfigMiddleware
 from tgbot.middlewares.database import DbSessionMiddleware
+from tgbot.middlewares.fsm import FSMBufferMiddleware
+from tgbot.middlewares.metrics import MetricsMiddleware, HandlerMetricsMiddleware
+from tgbot.middlewares.profiler import QueryProfilerMiddleware
+from tgbot.middlewares.throttling import ThrottlingMiddleware
 from tgbot.misc.default_commands import setup_default_commands
 from tgbot.services import broadcaster
+from tgbot.services.metrics import instrument_engine, instrument_storage, ApiMetricsMiddleware, start_metrics_server
+from tgbot.services.dispatcher import SerializedDispatcher
+from tgbot.services.storage import create_storage
+from tgbot.services.throttling import Limit, create_limiter
+from tgbot.services.webhook import start_webhook
 from tgbot.database.models.base import Base
 from tgbot.database.functions.setup import create_session_pool
 
 logger = logging.getLogger(__name__)
 
 
-async def on_startup(bot: Bot, config: Config):
+async def on_startup(bot: Bot, config: Config, session_pool):
     admin_ids = config.tg_bot.admin_ids
     await setup_default_commands(bot)
     await broadcaster.broadcast(bot, admin_ids, "Bot Started!")
+    # Resume broadcasts interrupted by restart or left by stopped replicas
+    broadcaster.run_in_background(broadcaster.resume_broadcast_jobs(bot, session_pool), name="resume-broadcasts")
 
 
 async def on_shutdown(db: Base):
@@ -31,11 +41,40 @@ async def on_shutdown(db: Base):
     logger.info("TABLES DROPPED!")
 
 
+# Admins page through applicants and reports much faster than users fill the form
+ADMIN_LIMITS = {"superuser": Limit(rate=5, burst=20), "admin": Limit(rate=5, burst=20)}
+
+
 def register_global_middlewares(dp: Dispatcher, config, session_pool):
+    # Registered in front of the dispatcher's FSM middleware, so reading the state is measured with everything else
+    has_fsm = dp.fsm in dp.update.outer_middleware
+    if has_fsm:
+        dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(MetricsMiddleware())
+    if has_fsm:
+        dp.update.outer_middleware(dp.fsm)
     dp.message.outer_middleware(ConfigMiddleware(config))
     dp.callback_query.outer_middleware(ConfigMiddleware(config))
-    dp.message.middleware(DbSessionMiddleware(session_pool=session_pool))
-    dp.callback_query.middleware(DbSessionMiddleware(session_pool=session_pool))
+    # Registered first of inner ones, so rejected updates don't take a database connection
+    throttling_middleware = ThrottlingMiddleware(
+        create_limiter(dp.storage),
+        default_limit=Limit(config.throttling.rate, config.throttling.burst),
+        router_limits=ADMIN_LIMITS
+    )
+    dp.message.middleware(throttling_middleware)
+    dp.callback_query.middleware(throttling_middleware)
+    db_session_middleware = DbSessionMiddleware(session_pool=session_pool)
+    dp.message.middleware(db_session_middleware)
+    dp.callback_query.middleware(db_session_middleware)
+    fsm_buffer_middleware = FSMBufferMiddleware()
+    dp.message.middleware(fsm_buffer_middleware)
+    dp.callback_query.middleware(fsm_buffer_middleware)
+    handler_metrics_middleware = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics_middleware)
+    dp.callback_query.middleware(handler_metrics_middleware)
+    query_profiler_middleware = QueryProfilerMiddleware()
+    dp.message.middleware(query_profiler_middleware)
+    dp.callback_query.middleware(query_profiler_middleware)
 
 
 async def main():
@@ -46,10 +85,13 @@ async def main():
     logger.info("Starting bot!")
     config = load_config(".env")
 
-    storage = MemoryStorage()
+    storage = create_storage(config)
     bot = Bot(token=config.tg_bot.token, parse_mode='HTML')
-    dp = Dispatcher(storage=storage)
+    dp = SerializedDispatcher(storage=storage)
     session_pool = await create_session_pool(db=config.db)
+    bot.session.middleware(ApiMetricsMiddleware())
+    instrument_engine(session_pool.kw["bind"])
+    instrument_storage(storage)
 
     for router in [
         superuser_router,
@@ -61,10 +103,20 @@ async def main():
 
     register_global_middlewares(dp, config, session_pool)
 
+    metrics_runner = None
+    if config.metrics.port:
+        metrics_runner = await start_metrics_server(config.metrics.host, config.metrics.port)
+
     try:
-        await on_startup(bot, config)
-        await dp.start_polling(bot)
+        await on_startup(bot, config, session_pool)
+        if config.tg_bot.use_webhook:
+            await start_webhook(dp, bot, config.webhook)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await dp.storage.close()
         await bot.session.close()
 
@@ -0,0 +1,664 @@
+"""
+Replay synthetic updates through the real dispatcher, routers, middlewares and database,
+so performance regressions show up before deploy.
+
+Bot API is simulated with network latency and flood control, the database and FSM storage are taken
+from the env file, point it to a separate database migrated with `alembic upgrade head`, never the production one.
+Users of the replay get telegram ids from BENCH_USER_ID, they and the departments added for the replay
+are deleted afterwards. Benchmarks of separate code paths (see BENCHMARKS) run against the same database.
+Every step is reported with its latency, Bot API calls, SQL statements, FSM storage calls, and the JSON size
+and serializing time of the FSM data it writes. The counters are not collected with --webhook, where the web server
+handles updates in its own tasks.
+
+    python replay.py new_user --users 200 --env bench.env
+    python replay.py departments --users 500 --latency 30 --env bench.env
+    python replay.py broadcast --users 1000 --env bench.env
+    python replay.py start --users 3000 --env bench.env  # Bursts of /start from new and then known users
+    python replay.py broadcast --users 1000 --rate-limit 30 --env bench.env  # Flood control also rejects /start
+    python replay.py new_user --users 200 --throttling --env bench.env  # Faster than the throttling allows
+    python replay.py departments --users 1000 --webhook --env bench.env  # Post updates to the webhook over HTTP
+    python replay.py new_user --users 200 --unbuffered --env bench.env  # Storage calls without the FSM buffer
+    python replay.py paging --departments 5000 --env bench.env
+    python replay.py keyboards --env bench.env
+    python replay.py explain --env bench.env  # Exits with an error when a hot query needs a sequential scan
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from datetime import date, datetime
+from typing import Awaitable, Callable, Iterator, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.methods import TelegramMethod, SendMessage, SendPhoto, SendDocument, EditMessageText
+from aiogram.types import InlineKeyboardMarkup, Message, Chat
+from aiohttp import web, ClientSession, TCPConnector
+from sqlalchemy import delete, insert, select, func, event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot import register_global_middlewares
+from tgbot.config import load_config, Throttling, Webhook
+from tgbot.handlers.superuser import superuser_router
+from tgbot.handlers.admin import admin_router
+from tgbot.handlers.echo import echo_router
+from tgbot.handlers.new_user import new_user_router
+from tgbot.keyboards.inline import (make_departments_keyboard, make_departments_id_keyboard, make_confirming_keyboard,
+                                    make_departments_rows, make_departments_id_rows, make_confirming_rows,
+                                    rows_to_markup)
+from tgbot.middlewares.fsm import FSMBufferMiddleware
+from tgbot.services import broadcaster
+from tgbot.services.dispatcher import SerializedDispatcher
+from tgbot.services.storage import create_storage
+from tgbot.services.webhook import BoundedRequestHandler, SECRET_TOKEN_HEADER
+from tgbot.database.functions.cache import departments_cache
+from tgbot.database.functions.payroll import make_payroll_query
+from tgbot.database.functions.setup import create_session_pool
+from tgbot.database.functions.users import get_departments_page
+from tgbot.database.models.models import Users, Departments, BroadcastJobs, Forms, FormsDepartments
+
+BENCH_USER_ID = 9_000_000_000
+BENCH_ADMIN_ID = BENCH_USER_ID  # Replayed users get the following ids
+BENCH_DEPARTMENT_TITLE = "Benchmark bo'limi"
+REGISTER_BUTTON = "\U0001f4dd Ro'yhatdan o'tish"
+
+
+
+@dataclass
+class StepStats:
+    """  Counted while one step of a replayed user is handled, and summed over all users by steps' names  """
+    api_calls: int = 0
+    db_queries: int = 0
+    storage_calls: int = 0
+    fsm_writes: int = 0
+    fsm_bytes: int = 0
+    fsm_dumps_time: float = 0.0
+
+    def add(self, other: "StepStats"):
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+step_stats: ContextVar[Optional[StepStats]] = ContextVar("step_stats", default=None)
+
+
+class SimulatedSession(BaseSession):
+    """
+    Bot API stand-in which answers after a random latency and applies flood control to sending methods.
+    Inline keyboards sent to every chat are kept, so replayed users press buttons the bot has really shown
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rate_limit: int = 30):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.sent_at: deque[float] = deque()
+        self.keyboards: dict[int, InlineKeyboardMarkup] = {}
+        self.message_ids = itertools.count(1)
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, timeout: int, chunk_size: int):
+        yield b""
+
+    def is_flooded(self) -> bool:
+        """  Sliding window of one second over all sending methods  """
+        now = time.monotonic()
+        while self.sent_at and now - self.sent_at[0] > 1:
+            self.sent_at.popleft()
+        if self.rate_limit and len(self.sent_at) >= self.rate_limit:
+            return True
+        self.sent_at.append(now)
+        return False
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        await asyncio.sleep(max(random.gauss(self.latency, self.jitter), 0))
+        self.calls += 1
+        stats = step_stats.get()
+        if stats is not None:
+            stats.api_calls += 1
+        if type(method).__name__.startswith("Send") and self.is_flooded():
+            self.rate_limited += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests: retry after 1", retry_after=1)
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(getattr(method, "reply_markup", None), InlineKeyboardMarkup):
+            self.keyboards[chat_id] = method.reply_markup
+        if isinstance(method, (SendMessage, SendPhoto, SendDocument, EditMessageText)):
+            message_id = getattr(method, "message_id", None) or next(self.message_ids)
+            return Message(message_id=message_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"))
+        return True
+
+    def find_button(self, chat_id: int, prefix: str) -> str:
+        """  Callback data of the first button in the last inline keyboard of the chat  """
+        keyboard = self.keyboards.get(chat_id)
+        for row in keyboard.inline_keyboard if keyboard else ():
+            for button in row:
+                if button.callback_data and button.callback_data.startswith(prefix):
+                    return button.callback_data
+        raise LookupError(f"No button {prefix!r} in chat {chat_id}")
+
+
+update_ids = itertools.count(1)
+
+
+def make_message_update(user_id: int, text: str) -> dict:
+    return {"update_id": next(update_ids), "message": {
+        "message_id": next(update_ids), "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "last_name": str(user_id)}}}
+
+
+def make_callback_update(user_id: int, data: str) -> dict:
+    return {"update_id": next(update_ids), "callback_query": {
+        "id": str(next(update_ids)), "chat_instance": str(user_id), "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "last_name": str(user_id)},
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                    "text": "-"}}}
+
+
+def make_photo_update(user_id: int) -> dict:
+    update = make_message_update(user_id, "")
+    del update["message"]["text"]
+    update["message"]["photo"] = [{"file_id": "benchmark", "file_unique_id": "benchmark", "width": 600, "height": 800}]
+    return update
+
+
+Step = tuple[str, Callable[[int, SimulatedSession], dict]]
+
+
+def send(name: str, text: str) -> Step:
+    return name, lambda user_id, session: make_message_update(user_id, text)
+
+
+def press(name: str, prefix: str) -> Step:
+    return name, lambda user_id, session: make_callback_update(user_id, session.find_button(user_id, prefix))
+
+
+def send_photo(name: str) -> Step:
+    return name, lambda user_id, session: make_photo_update(user_id)
+
+
+REGISTRATION = [
+    send("start", "/start"),
+    send("register", REGISTER_BUTTON),
+    send("name", "Ali Valiyev"),
+    send("birth_date", "24.03.1998"),
+    send("phonenum", "+998901234567"),
+    press("confirm_phonenum", "yes"),
+]
+
+SCENARIOS: dict[str, list[Step]] = {
+    "new_user": [
+        *REGISTRATION,
+        press("departments_next", "main:departments:next"),
+        press("department_select", "main:departments:select"),
+        press("fill_form", "fill_form"),
+        send("address", "Toshkent, Chilonzor"),
+        press("living_conditions", "main:living_conditions::flat"),
+        press("education", "main:educations::master"),
+        press("university_add", "main:universities::add"),
+        send("university_name", "TATU"),
+        send("university_direction", "Dasturiy injiniring"),
+        send("university_finished_year", "2018"),
+        press("universities_next", "main:universities::next"),
+        press("company_add", "main:worked_companies::add"),
+        send("company_name", "Korxona"),
+        send("company_position", "Dasturchi"),
+        send("company_working_period", "2018 - 2021"),
+        send("company_leaving_reason", "Ko'chib o'tdim"),
+        press("companies_next", "main:worked_companies::next"),
+        press("trip_add", "main:trips::add"),
+        send("trip_country", "Germaniya"),
+        send("trip_reason", "Ta'lim"),
+        send("trip_period", "2019"),
+        press("trips_next", "main:trips::next"),
+        press("marital_status", "main:marital_status::married"),
+        press("business_trip", "main:business_trip::yes"),
+        press("military_service", "main:military_service::no"),
+        send("criminal_record", "Yo'q"),
+        send("driver_license", "B"),
+        send("personal_car", "Yo'q"),
+        press("russian", "main:russian::2"),
+        press("english", "main:english::1"),
+        press("chinese", "main:chinese::0"),
+        press("word", "main:word::3"),
+        press("excel", "main:excel::2"),
+        press("1c", "main:1c::0"),
+        press("origin", "main:origin::telegram"),
+        send("salary_last_job", "3 000 000 so'm"),
+        press("overwork_agreement", "main:overwork_agreement::yes"),
+        press("force_majeure_salary_agreement", "main:force_majeure_salary_agreement::no"),
+        press("working_style", "main:working_style::collective"),
+        send("health", "Sog'lom"),
+        send_photo("submit_form"),
+    ],
+    "departments": [
+        *REGISTRATION,
+        *(press("departments_next", "main:departments:next") for _ in range(2)),  # 20 departments, 8 per page
+        *(press("departments_previous", "main:departments:previous") for _ in range(2)),
+    ],
+    "broadcast": [
+        send("start", "/start"),
+    ],
+    # All users press /start at once, then again: the first burst upserts users, the second is served by the cache
+    "start": [
+        send("start", "/start"),
+        send("start_again", "/start"),
+    ],
+}
+
+
+class WebhookFeeder:
+    """
+    Posts updates to the webhook handler served on a local port, as Telegram does with at most
+    WEBHOOK_MAX_CONNECTIONS requests at once, and waits until the dispatcher has handled them
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, webhook: Webhook):
+        self.dp = dp
+        self.bot = bot
+        self.webhook = webhook
+        self.handled: dict[int, asyncio.Future] = {}
+        self.response_times: list[float] = []
+        self.runner: Optional[web.AppRunner] = None
+        self.client: Optional[ClientSession] = None
+        self.url = ""
+        feed_update = dp.feed_update
+
+        async def feed_and_notify(bot: Bot, update, **kwargs):
+            future = self.handled.pop(update.update_id, None)
+            try:
+                result = await feed_update(bot, update, **kwargs)
+            except Exception as e:
+                if future is not None:
+                    future.set_exception(e)
+                raise
+            if future is not None:
+                future.set_result(result)
+            return result
+
+        dp.feed_update = feed_and_notify
+
+    async def start(self):
+        app = web.Application()
+        BoundedRequestHandler(dispatcher=self.dp, bot=self.bot, secret=self.webhook.secret,
+                              max_concurrent_updates=self.webhook.max_concurrent_updates).register(app, path="/webhook")
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host="127.0.0.1", port=0).start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/webhook"
+        self.client = ClientSession(connector=TCPConnector(limit=self.webhook.max_connections))
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def __call__(self, update: dict):
+        future = self.handled[update["update_id"]] = asyncio.get_running_loop().create_future()
+        started_at = time.perf_counter()
+        headers = {SECRET_TOKEN_HEADER: self.webhook.secret}
+        async with self.client.post(self.url, json=update, headers=headers) as response:
+            response.raise_for_status()
+        self.response_times.append(time.perf_counter() - started_at)
+        await future
+
+    def print(self):
+        times = sorted(self.response_times) or [0.0]
+        quantiles = ", ".join(f"p{q * 100:g} {times[int(q * (len(times) - 1))] * 1000:.1f} ms"
+                              for q in (0.5, 0.95, 0.99))
+        print(f"Webhook responses: {quantiles}, max {times[-1] * 1000:.1f} ms, "
+              f"{self.webhook.max_connections} connections, {self.webhook.max_concurrent_updates} updates at once")
+
+
+Feed = Callable[[dict], Awaitable]
+
+
+def count_queries(session_pool: Callable[[], AsyncSession]):
+    """  Count SQL statements executed by every step  """
+
+    @event.listens_for(session_pool.kw["bind"].sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = step_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+
+
+def measure_storage(storage: BaseStorage):
+    """
+    Count calls of the FSM storage made by every step, each one is a round trip with Redis storage
+    (update_data takes more, but buffered FSM contexts never call it).
+    Measure FSM data written by every step: size of its JSON and time of serializing it,
+    which Redis storage pays on every write. Memory storage keeps data as is, so it is serialized here only to measure
+    """
+
+    def observe(bot: Bot, data: Optional[dict]):
+        stats = step_stats.get()
+        if stats is None or data is None:
+            return
+        started_at = time.perf_counter()
+        payload = bot.session.json_dumps(data)
+        stats.fsm_dumps_time += time.perf_counter() - started_at
+        stats.fsm_writes += 1
+        stats.fsm_bytes += len(payload.encode())
+
+    def measure(method, writes: bool, returns_data: bool):
+        async def measured(**kwargs):
+            stats = step_stats.get()
+            if stats is not None:
+                stats.storage_calls += 1
+            result = await method(**kwargs)
+            if writes:
+                observe(kwargs["bot"], result if returns_data else kwargs.get("data"))
+            return result
+
+        return measured
+
+    # Storages, FSM contexts and the dispatcher pass arguments by keywords
+    methods = (("get_state", False, False), ("set_state", False, False), ("get_data", False, False),
+               ("set_data", True, False), ("update_data", True, True), ("set_record", True, False))
+    for name, writes, returns_data in methods:
+        if hasattr(storage, name):
+            setattr(storage, name, measure(getattr(storage, name), writes, returns_data))
+
+
+class Report:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.stats: dict[str, StepStats] = defaultdict(StepStats)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    @property
+    def updates(self) -> int:
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    def print(self, elapsed: float, session: SimulatedSession):
+        db_queries = sum(stats.db_queries for stats in self.stats.values())
+        storage_calls = sum(stats.storage_calls for stats in self.stats.values())
+        print(f"{self.updates} updates in {elapsed:.2f} s: {self.updates / elapsed:.1f} updates/s, "
+              f"{session.calls / max(self.updates, 1):.2f} API calls/update, "
+              f"{db_queries / max(self.updates, 1):.2f} queries/update, "
+              f"{storage_calls / max(self.updates, 1):.2f} storage calls/update, "
+              f"{sum(self.errors.values())} errors, {session.rate_limited} rate limited")
+        print(f"{'step':32}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'calls':>7}"
+              f"{'queries':>8}{'storage':>8}{'fsm B':>8}{'dumps us':>10}{'errors':>8}")
+        for name, latencies in self.latencies.items():
+            latencies.sort()
+            quantiles = (latencies[int(q * (len(latencies) - 1))] * 1000 for q in (0.5, 0.95, 0.99))
+            stats = self.stats[name]
+            writes = max(stats.fsm_writes, 1)  # Size and serializing time are shown per write of FSM data
+            print(f"{name:32}{len(latencies):7}{''.join(f'{value:9.1f}' for value in quantiles)}"
+                  f"{latencies[-1] * 1000:9.1f}{stats.api_calls / len(latencies):7.2f}"
+                  f"{stats.db_queries / len(latencies):8.2f}{stats.storage_calls / len(latencies):8.2f}"
+                  f"{stats.fsm_bytes / writes:8.0f}{stats.fsm_dumps_time / writes * 1_000_000:10.1f}"
+                  f"{self.errors[name]:8}")
+
+
+async def replay_user(feed: Feed, session: SimulatedSession, user_id: int, steps: list[Step], report: Report,
+                      semaphore: asyncio.Semaphore):
+    async with semaphore:
+        for name, make_update in steps:
+            stats = StepStats()
+            step_stats.set(stats)
+            started_at = time.perf_counter()
+            try:
+                await feed(make_update(user_id, session))
+            except Exception as e:
+                report.errors[name] += 1
+                logging.debug("User %s failed on %s: %r", user_id, name, e)
+                return  # The rest of the scenario depends on this step
+            finally:
+                report.latencies[name].append(time.perf_counter() - started_at)
+                report.stats[name].add(stats)
+
+
+Benchmark = Callable[[argparse.Namespace, Callable[[], AsyncSession]], Awaitable]
+
+
+async def bench_paging(args: argparse.Namespace, session_pool: Callable[[], AsyncSession]):
+    """  Walk through all departments with keyset pages of the cache against SQL keyset and OFFSET pages  """
+    page_size = 8
+    columns = select(Departments.department_id, Departments.title).order_by(Departments.department_id)
+    async with session_pool() as session:
+        count = await session.scalar(select(func.count()).select_from(Departments))
+        pages = -(-count // page_size)
+
+        async def walk(get_page) -> tuple[float, float]:
+            """  :return: mean and last page time, ms  """
+            times, cursor = [], None
+            for number in range(pages):
+                started_at = time.perf_counter()
+                cursor = await get_page(number, cursor)
+                times.append(time.perf_counter() - started_at)
+            return sum(times) / len(times) * 1000, times[-1] * 1000
+
+        async def cache_page(number, after):
+            page = await get_departments_page(session, limit=page_size, after=after)
+            return page.departments[-1][0]
+
+        async def keyset_page(number, after):
+            query = columns.limit(page_size + 1)  # One more row tells if there is a next page
+            if after is not None:
+                query = query.where(Departments.department_id > after)
+            return (await session.execute(query)).all()[:page_size][-1][0]
+
+        async def offset_page(number, after):
+            return (await session.execute(columns.offset(number * page_size).limit(page_size + 1))).all()[0][0]
+
+        departments_cache.invalidate()
+        await departments_cache.load(session)
+        print(f"{count} departments, {pages} pages of {page_size}")
+        print(f"{'paging':16}{'mean ms':>9}{'last ms':>9}")
+        for name, get_page in (("cache keyset", cache_page), ("sql keyset", keyset_page), ("sql offset", offset_page)):
+            print(f"{name:16}{''.join(f'{value:9.3f}' for value in await walk(get_page))}")
+
+
+async def bench_keyboards(args: argparse.Namespace, session_pool: Callable[[], AsyncSession]):
+    """  Build inline keyboards of departments' pages and the form from scratch and from their caches  """
+    async with session_pool() as session:
+        pages = [await get_departments_page(session, limit=8)]
+        while pages[-1].has_next:
+            pages.append(await get_departments_page(session, limit=8, after=pages[-1].departments[-1][0]))
+    # Keyboard, its cached rows and keys. Without the cache the rows are built, with it only the markup is
+    builders = (
+        ("departments", make_departments_keyboard, make_departments_rows, pages),
+        ("departments_id", make_departments_id_keyboard, make_departments_id_rows, pages),
+        ("confirming", make_confirming_keyboard, make_confirming_rows, ["universities", "worked_companies", "trips"]),
+    )
+    rounds = max(1000 // len(pages), 10)
+    print(f"{len(pages)} pages of departments, {rounds} rounds")
+    print(f"{'keyboard':16}{'built us':>10}{'cached us':>11}")
+    for name, builder, rows_builder, keys in builders:
+        times = []
+        for build in (lambda key: rows_to_markup(rows_builder.__wrapped__(key)), builder):
+            started_at = time.perf_counter()
+            for _ in range(rounds):
+                for key in keys:
+                    build(key)
+            times.append((time.perf_counter() - started_at) / rounds / len(keys) * 1_000_000)
+        print(f"{name:16}{times[0]:10.1f}{times[1]:11.2f}")
+
+
+# Queries run on every update or report, name -> query. Their plans must not read a whole table
+HOT_QUERIES = {
+    "user by telegram_id": select(Users).where(Users.telegram_id == BENCH_USER_ID),
+    "forms by department": select(Forms.form_id, Forms.full_name).join(FormsDepartments).where(
+        FormsDepartments.department_id == 1).order_by(Forms.form_id.desc()).limit(10),
+    "payroll by month": make_payroll_query(date.today()),
+}
+
+
+def find_seq_scans(plan: dict) -> Iterator[str]:
+    """  Tables read by Seq Scan nodes of a plan in JSON format  """
+    if plan["Node Type"] == "Seq Scan":
+        yield plan["Relation Name"]
+    for subplan in plan.get("Plans", ()):
+        yield from find_seq_scans(subplan)
+
+
+async def bench_explain(args: argparse.Namespace, session_pool: Callable[[], AsyncSession]):
+    """
+    Fail when a hot query falls back to a sequential scan. Sequential scans are disabled for the planner,
+    so it still uses one only when no index serves the query, however few rows the bench database has
+    """
+    failed = []
+    async with session_pool() as session:
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, query in HOT_QUERIES.items():
+            compiled = query.compile(dialect=session.bind.dialect)
+            parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+            connection = await session.connection()
+            result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", parameters)
+            [plan], = result.one()
+            tables = sorted(set(find_seq_scans(plan["Plan"])))
+            print(f"{name:24}{'seq scan of ' + ', '.join(tables) if tables else 'index scans'}")
+            if tables:
+                failed.append(name)
+        await session.rollback()
+    if failed:
+        raise SystemExit(f"Sequential scans in: {', '.join(failed)}")
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "paging": bench_paging,
+    "keyboards": bench_keyboards,
+    "explain": bench_explain,
+}
+
+
+async def seed_departments(session_pool, count=20) -> list[int]:
+    """
+    Handlers send photos of departments, so the replay needs departments with photos.
+    Departments are added only up to `count`, ids of the added ones are returned to delete them afterwards
+    """
+    async with session_pool() as session:
+        missing = count - await session.scalar(select(func.count()).select_from(Departments))
+        if missing <= 0:
+            return []
+        result = await session.execute(insert(Departments).values([
+            {"title": f"{BENCH_DEPARTMENT_TITLE} {i}", "description": "Benchmark", "photo_id": "benchmark"}
+            for i in range(missing)]).returning(Departments.department_id))
+        await session.commit()
+        return list(result.scalars())
+
+
+async def delete_bench_departments(session_pool, department_ids: list[int]):
+    if department_ids:
+        async with session_pool() as session:
+            await session.execute(delete(Departments).where(Departments.department_id.in_(department_ids)))
+            await session.commit()
+
+
+async def delete_bench_users(session_pool):
+    async with session_pool() as session:
+        await session.execute(delete(Forms).where(Forms.form_id.in_(
+            select(Users.form_id).where(Users.telegram_id >= BENCH_USER_ID))).execution_options(
+            synchronize_session=False))
+        await session.execute(delete(BroadcastJobs).where(BroadcastJobs.creator_id >= BENCH_USER_ID))
+        await session.execute(delete(Users).where(Users.telegram_id >= BENCH_USER_ID))
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic updates through the bot")
+    parser.add_argument("scenario", choices=[*SCENARIOS, *BENCHMARKS], help="Scenario of users, or a benchmark")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=0, help="Users replayed at once, all by default")
+    parser.add_argument("--latency", type=float, default=50, help="Mean Bot API latency, ms")
+    parser.add_argument("--jitter", type=float, default=20, help="Standard deviation of the latency, ms")
+    parser.add_argument("--rate-limit", type=int, default=0,
+                        help="Sending methods per second, Telegram allows about 30 in bulk, 0 disables")
+    parser.add_argument("--departments", type=int, default=20, help="Departments added when there are fewer")
+    parser.add_argument("--throttling", action="store_true",
+                        help="Keep the throttling of the env file, replayed users don't pause between steps")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Post updates to the webhook handler over HTTP instead of feeding the dispatcher")
+    parser.add_argument("--unbuffered", action="store_true",
+                        help="Remove the FSM buffer middleware, handlers call the storage directly")
+    parser.add_argument("--env", required=True,
+                        help="Env file of a bench database, the replay writes to it. The bot's .env is refused")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if os.path.abspath(args.env) == os.path.abspath(".env"):
+        parser.error("--env points to the bot's .env, create a separate env file with a bench database")
+
+    config = load_config(args.env)
+    config.tg_bot.admin_ids.append(BENCH_ADMIN_ID)
+    if not args.throttling:
+        config.throttling = Throttling(rate=1000, burst=1000)
+    api_session = SimulatedSession(latency=args.latency / 1000, jitter=args.jitter / 1000, rate_limit=args.rate_limit)
+    bot = Bot(token=config.tg_bot.token, session=api_session, parse_mode="HTML")
+    dp = SerializedDispatcher(storage=create_storage(config))
+    measure_storage(dp.storage)
+    session_pool = await create_session_pool(db=config.db)
+    for router in [superuser_router, admin_router, new_user_router, echo_router]:
+        dp.include_router(router)
+    register_global_middlewares(dp, config, session_pool)
+    if args.unbuffered:
+        for observer in (dp.message, dp.callback_query):
+            for middleware in [m for m in observer.middleware if isinstance(m, FSMBufferMiddleware)]:
+                observer.middleware.unregister(middleware)
+    department_ids = await seed_departments(session_pool, args.departments)
+    await delete_bench_users(session_pool)
+    count_queries(session_pool)
+
+    report = Report()
+    semaphore = asyncio.Semaphore(args.concurrency or args.users)
+    feed: Feed = lambda update: dp.feed_raw_update(bot, update)
+    if args.webhook:
+        feed = WebhookFeeder(dp, bot, config.webhook)
+    try:
+        if args.scenario in BENCHMARKS:
+            await BENCHMARKS[args.scenario](args, session_pool)
+            return
+        if args.webhook:
+            await feed.start()
+        started_at = time.perf_counter()
+        await asyncio.gather(*(
+            replay_user(feed, api_session, BENCH_USER_ID + i, SCENARIOS[args.scenario], report, semaphore)
+            for i in range(1, args.users + 1)
+        ))
+        report.print(time.perf_counter() - started_at, api_session)
+        if args.webhook:
+            feed.print()
+        if args.scenario == "broadcast":
+            await replay_broadcast(dp, bot, api_session)
+    finally:
+        if args.webhook:
+            await feed.close()
+        await delete_bench_users(session_pool)
+        await delete_bench_departments(session_pool, department_ids)
+        await dp.storage.close()
+        await session_pool.kw["bind"].dispose()
+
+
+async def replay_broadcast(dp: Dispatcher, bot: Bot, session: SimulatedSession):
+    """  Send a broadcast to all users and wait until the job is finished  """
+    await asyncio.sleep(1)  # Let the window of flood control pass after users' updates
+    calls, rate_limited = session.calls, session.rate_limited
+    await dp.feed_raw_update(bot, make_message_update(BENCH_ADMIN_ID, "/start"))  # Creator of the job must exist
+    started_at = time.perf_counter()
+    await dp.feed_raw_update(bot, make_message_update(BENCH_ADMIN_ID, "/broadcast Benchmark"))
+    while broadcaster.background_tasks:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started_at
+    print(f"Broadcast: {session.calls - calls} API calls in {elapsed:.2f} s, "
+          f"{(session.calls - calls) / elapsed:.1f} calls/s, {session.rate_limited - rate_limited} rate limited")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
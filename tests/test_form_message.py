@@ -0,0 +1,84 @@
+import asyncio
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import TelegramMethod
+
+from tgbot.keyboards.inline import menu_control_keyboard
+from tgbot.services.form_message import edit_form_message, render_form_text
+
+
+class CountingSession(BaseSession):
+    """  Bot API stand-in which records called methods instead of sending them  """
+
+    def __init__(self, error: Optional[str] = None):
+        super().__init__()
+        self.calls = []
+        self.error = error
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, timeout: int, chunk_size: int):
+        yield b""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.calls.append(type(method).__name__)
+        if self.error:
+            raise TelegramBadRequest(method=method, message=self.error)
+        return True
+
+
+# Form data and question after every step of the new_user flow, the last step repeats an unchanged answer
+STEPS = (
+    ({}, "Ism va familiyangizni kiriting"),
+    ({"full_name": "Ali Valiyev"}, "Tug'ilgan sanangizni kiriting"),
+    ({"full_name": "Ali Valiyev", "birthday": "01.01.2000"}, "Telefon raqamingizni yuboring"),
+    ({"full_name": "Ali Valiyev", "birthday": "01.01.2000"}, "Telefon raqamingizni yuboring"),
+)
+
+
+def run_steps(session: CountingSession) -> list[int]:
+    """  Bot API calls made by every step  """
+    async def run():
+        bot, form_hash, calls_per_step = Bot("42:TEST", session=session), None, []
+        for form, question in STEPS:
+            calls = len(session.calls)
+            form_hash = await edit_form_message(bot, chat_id=1, message_id=1, form=form, question=question,
+                                                reply_markup=menu_control_keyboard, last_hash=form_hash)
+            calls_per_step.append(len(session.calls) - calls)
+        return calls_per_step
+
+    return asyncio.run(run())
+
+
+def test_one_edit_per_changed_step_and_none_for_unchanged():
+    session = CountingSession()
+    assert run_steps(session) == [1, 1, 1, 0]
+    assert set(session.calls) == {"EditMessageText"}
+
+
+def test_changed_keyboard_is_edited():
+    async def run():
+        session = CountingSession()
+        bot = Bot("42:TEST", session=session)
+        form_hash = await edit_form_message(bot, 1, 1, {}, "Savol")
+        await edit_form_message(bot, 1, 1, {}, "Savol", reply_markup=menu_control_keyboard, last_hash=form_hash)
+        return session.calls
+
+    assert asyncio.run(run()) == ["EditMessageText", "EditMessageText"]
+
+
+def test_not_modified_error_is_ignored():
+    session = CountingSession(error="Bad Request: message is not modified")
+    assert run_steps(session) == [1, 1, 1, 0]
+
+
+def test_answers_are_escaped():
+    form = {"full_name": "<b>Ali</b> & Vali", "companies": [{"name": "Korxona <MChJ>"}]}
+    text = render_form_text(form)
+    assert "&lt;b&gt;Ali&lt;/b&gt; &amp; Vali" in text
+    assert "Korxona &lt;MChJ&gt;" in text
+    assert "<MChJ>" not in text
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from tgbot.services.storage import PipelinedRedisStorage  # noqa: E402
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def make_storage(server=None) -> PipelinedRedisStorage:
+    """  Storages made with the same server share the records, as replicas of the bot do  """
+    return PipelinedRedisStorage(redis=fakeredis.aioredis.FakeRedis(server=server or fakeredis.FakeServer()))
+
+
+def test_concurrent_update_data_keeps_every_change():
+    async def run():
+        storage, bot = make_storage(), Bot("42:TEST")
+        await asyncio.gather(*(storage.update_data(bot, KEY, {f"answer{i}": i}) for i in range(50)))
+        return await storage.get_data(bot, KEY)
+
+    assert asyncio.run(run()) == {f"answer{i}": i for i in range(50)}
+
+
+def test_update_data_retries_when_record_changes():
+    async def run():
+        server = fakeredis.FakeServer()
+        storage, replica, bot = make_storage(server), make_storage(server), Bot("42:TEST")
+        await storage.set_data(bot, KEY, {"name": "Ali"})
+        reads = []
+        pipeline = storage.redis.pipeline
+
+        def interfering_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            get = pipe.get
+
+            async def get_and_interfere(name):
+                value = await get(name)
+                reads.append(value)
+                if len(reads) == 1:
+                    # Another replica writes the record between WATCH and EXEC of the first attempt
+                    await replica.update_data(bot, KEY, {"phone": "1"})
+                return value
+
+            pipe.get = get_and_interfere
+            return pipe
+
+        storage.redis.pipeline = interfering_pipeline
+        result = await storage.update_data(bot, KEY, {"birth_date": "2000-01-01"})
+        return result, await storage.get_data(bot, KEY), len(reads)
+
+    result, stored, reads = asyncio.run(run())
+    assert reads == 2
+    assert result == stored == {"name": "Ali", "phone": "1", "birth_date": "2000-01-01"}
+
+
+def test_set_record_writes_state_and_data_in_one_transaction():
+    async def run():
+        storage, bot = make_storage(), Bot("42:TEST")
+        executed = []
+        pipeline = storage.redis.pipeline
+
+        def counting_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            async def counting_execute(*a, **kw):
+                executed.append(len(pipe.command_stack))
+                return await execute(*a, **kw)
+
+            pipe.execute = counting_execute
+            return pipe
+
+        storage.redis.pipeline = counting_pipeline
+        await storage.set_record(bot, KEY, state="Form:name", data={"name": "Ali"})
+        first = await storage.get_state(bot, KEY), await storage.get_data(bot, KEY)
+        await storage.set_record(bot, KEY, state="Form:phone")
+        second = await storage.get_state(bot, KEY), await storage.get_data(bot, KEY)
+        await storage.set_record(bot, KEY, state=None, data={})
+        third = await storage.get_state(bot, KEY), await storage.get_data(bot, KEY)
+        return executed, first, second, third
+
+    executed, first, second, third = asyncio.run(run())
+    assert executed == [2, 1, 2]  # One MULTI/EXEC per record, data=None leaves the data untouched
+    assert first == ("Form:name", {"name": "Ali"})
+    assert second == ("Form:phone", {"name": "Ali"})
+    assert third == (None, {})
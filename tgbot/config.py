@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from environs import Env
 from sqlalchemy.engine.url import URL
@@ -12,6 +12,15 @@ class DbConfig:
     port: int
     database: str
     pg_password: str
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_cache_size: int = 100
+    connect_timeout: int = 10
+    profile: bool = False
+    slow_query_ms: int = 100
 
     # We provide a method to create a connection string easily.
     def construct_sqlalchemy_url(self, driver="asyncpg") -> URL:
@@ -25,11 +34,54 @@ class DbConfig:
         )
 
 
+@dataclass
+class RedisConfig:
+    host: str
+    port: int
+    db: int
+    password: str = None
+    max_connections: int = 20
+    state_ttl: int = None
+    data_ttl: int = None
+
+    # The same idea as for the database, a connection string for the Redis pool.
+    def construct_redis_url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{self.host}:{self.port}/{self.db}"
+
+
 @dataclass
 class TgBot:
     token: str
     admin_ids: list[int]
     use_redis: bool
+    use_webhook: bool = False
+
+
+@dataclass
+class Webhook:
+    url: str
+    path: str
+    secret: str
+    app_host: str
+    app_port: int
+    max_connections: int = 40
+    max_concurrent_updates: int = 100
+
+    def construct_webhook_url(self) -> str:
+        return self.url.rstrip("/") + self.path
+
+
+@dataclass
+class Metrics:
+    host: str = "127.0.0.1"
+    port: int = 0  # Metrics endpoint is disabled when the port is 0
+
+
+@dataclass
+class Throttling:
+    rate: float = 2.0  # Updates per second a user can keep sending
+    burst: int = 10  # Updates a user can send at once after a pause
 
 
 @dataclass
@@ -41,7 +93,11 @@ class Miscellaneous:
 class Config:
     tg_bot: TgBot
     db: DbConfig
+    redis: RedisConfig
+    webhook: Webhook
     misc: Miscellaneous
+    metrics: Metrics = field(default_factory=Metrics)
+    throttling: Throttling = field(default_factory=Throttling)
 
 
 def load_config(path: str = None):
@@ -53,6 +109,7 @@ def load_config(path: str = None):
             token=env.str("BOT_TOKEN"),
             admin_ids=list(map(int, env.list("ADMINS"))),
             use_redis=env.bool("USE_REDIS"),
+            use_webhook=env.bool("USE_WEBHOOK", False),
         ),
         db=DbConfig(
             user=env.str('DB_USER'),
@@ -60,7 +117,42 @@ def load_config(path: str = None):
             host=env.str('DB_HOST'),
             port=env.int('DB_PORT'),
             database=env.str('DB_NAME'),
-            pg_password=env.str('PG_PASS')
+            pg_password=env.str('PG_PASS'),
+            pool_size=env.int('DB_POOL_SIZE', 10),
+            max_overflow=env.int('DB_MAX_OVERFLOW', 10),
+            pool_timeout=env.int('DB_POOL_TIMEOUT', 30),
+            pool_recycle=env.int('DB_POOL_RECYCLE', 1800),
+            pool_pre_ping=env.bool('DB_POOL_PRE_PING', True),
+            statement_cache_size=env.int('DB_STATEMENT_CACHE_SIZE', 100),
+            connect_timeout=env.int('DB_CONNECT_TIMEOUT', 10),
+            profile=env.bool('DB_PROFILE', False),
+            slow_query_ms=env.int('DB_SLOW_QUERY_MS', 100)
+        ),
+        redis=RedisConfig(
+            host=env.str('REDIS_HOST', 'localhost'),
+            port=env.int('REDIS_PORT', 6379),
+            db=env.int('REDIS_DB', 0),
+            password=env.str('REDIS_PASS', None),
+            max_connections=env.int('REDIS_MAX_CONNECTIONS', 20),
+            state_ttl=env.int('REDIS_STATE_TTL', 60 * 60 * 24),
+            data_ttl=env.int('REDIS_DATA_TTL', 60 * 60 * 24)
+        ),
+        webhook=Webhook(
+            url=env.str('WEBHOOK_URL', ''),
+            path=env.str('WEBHOOK_PATH', '/webhook'),
+            secret=env.str('WEBHOOK_SECRET', ''),
+            app_host=env.str('WEBAPP_HOST', '0.0.0.0'),
+            app_port=env.int('WEBAPP_PORT', 8080),
+            max_connections=env.int('WEBHOOK_MAX_CONNECTIONS', 40),
+            max_concurrent_updates=env.int('WEBHOOK_MAX_CONCURRENT_UPDATES', 100)
         ),
-        misc=Miscellaneous()
+        misc=Miscellaneous(),
+        metrics=Metrics(
+            host=env.str('METRICS_HOST', '127.0.0.1'),
+            port=env.int('METRICS_PORT', 0)
+        ),
+        throttling=Throttling(
+            rate=env.float('THROTTLING_RATE', 2.0),
+            burst=env.int('THROTTLING_BURST', 10)
+        )
     )
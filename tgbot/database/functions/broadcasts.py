@@ -0,0 +1,85 @@
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import insert, select, update, func, or_, and_
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.models.models import Users, BroadcastJobs
+
+
+async def add_broadcast_job(session: AsyncSession, text, creator_id=None) -> int:
+    """  Create a broadcast job for all users and return its id  """
+    total = select(func.count()).select_from(Users).scalar_subquery()
+    query = insert(BroadcastJobs).values(text=text, creator_id=creator_id, total=total).returning(
+        BroadcastJobs.job_id)
+    result = await session.execute(query)
+    await session.commit()
+    return result.scalar_one()
+
+
+async def get_unfinished_broadcast_jobs(session: AsyncSession):
+    """  Get ids of broadcast jobs which were not finished, e.g. because of restart  """
+    query = select(BroadcastJobs.job_id).where(BroadcastJobs.status.in_(["PENDING", "RUNNING"])).order_by(
+        BroadcastJobs.job_id)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def get_last_broadcast_jobs(session: AsyncSession, limit=5):
+    """
+    Get the latest broadcast jobs with seconds elapsed since they were started.
+    The time is counted by the database, which has set started_at, so the clock of the bot doesn't matter
+    """
+    elapsed = func.extract("epoch", func.now() - BroadcastJobs.started_at).label("elapsed")
+    query = select(BroadcastJobs, elapsed).order_by(BroadcastJobs.job_id.desc()).limit(limit)
+    result = await session.execute(query)
+    return result.all()
+
+
+async def get_recipients(session: AsyncSession, after_id=0, limit=500):
+    """  Get the next batch of users' ids after the given one (keyset pagination)  """
+    query = select(Users.telegram_id).where(Users.telegram_id > after_id).order_by(Users.telegram_id).limit(limit)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def claim_broadcast_job(session: AsyncSession, job_id, owner: str, lease: float) -> Optional[Row]:
+    """
+    Take a pending job, or a running one whose owner hasn't saved progress for `lease` seconds, in one statement,
+    so only one replica of the bot runs it
+    :return: text and last_user_id of the claimed job, None when the job is finished or run by someone else
+    """
+    expired = or_(BroadcastJobs.heartbeat_at.is_(None),
+                  BroadcastJobs.heartbeat_at < func.now() - timedelta(seconds=lease))
+    query = update(BroadcastJobs).where(
+        BroadcastJobs.job_id == job_id,
+        or_(BroadcastJobs.status == "PENDING", and_(BroadcastJobs.status == "RUNNING", expired))
+    ).values(status="RUNNING", claimed_by=owner, heartbeat_at=func.now(),
+             started_at=func.coalesce(BroadcastJobs.started_at, func.now())).returning(
+        BroadcastJobs.text, BroadcastJobs.last_user_id).execution_options(synchronize_session=False)
+    result = await session.execute(query)
+    job = result.first()
+    await session.commit()
+    return job
+
+
+async def save_broadcast_progress(session: AsyncSession, job_id, owner: str, last_user_id, sent, failed) -> bool:
+    """
+    Checkpoint a processed batch of a broadcast job and renew the owner's lease
+    :return: False when the job was taken over by another replica
+    """
+    query = update(BroadcastJobs).where(BroadcastJobs.job_id == job_id, BroadcastJobs.claimed_by == owner).values(
+        last_user_id=last_user_id, sent=BroadcastJobs.sent + sent, failed=BroadcastJobs.failed + failed,
+        heartbeat_at=func.now())
+    result = await session.execute(query)
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def finish_broadcast_job(session: AsyncSession, job_id, owner: str):
+    """  Mark a broadcast job as done  """
+    query = update(BroadcastJobs).where(BroadcastJobs.job_id == job_id, BroadcastJobs.claimed_by == owner).values(
+        status="DONE", finished_at=func.now())
+    await session.execute(query)
+    await session.commit()
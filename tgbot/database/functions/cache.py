@@ -0,0 +1,111 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.models.models import Departments
+
+
+class DepartmentsPage(NamedTuple):
+    departments: tuple[tuple[int, str], ...]
+    has_prev: bool
+    has_next: bool
+
+
+class DepartmentsCache:
+    """
+    In-process copy of the departments catalogue.
+    Departments change rarely, so the whole table is kept in memory and reloaded only after
+    add/delete (version bump) or when the TTL expires, which also picks up changes made by other replicas
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.version = 0
+        self.loaded_version: Optional[int] = None
+        self.loaded_at = 0.0
+        self.ids: list[int] = []
+        self.titles: list[str] = []
+        self.details: dict[int, tuple[str, Optional[str], Optional[str]]] = {}
+        self.lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def is_fresh(self) -> bool:
+        return self.loaded_version == self.version and time.monotonic() - self.loaded_at < self.ttl
+
+    async def load(self, session: AsyncSession):
+        if self.is_fresh():
+            return
+        async with self.lock:
+            if self.is_fresh():
+                return
+            version = self.version
+            query = select(Departments.department_id, Departments.title, Departments.description,
+                           Departments.photo_id).order_by(Departments.department_id)
+            rows = (await session.execute(query)).all()
+            self.ids = [row[0] for row in rows]
+            self.titles = [row[1] for row in rows]
+            self.details = {row[0]: (row[1], row[2], row[3]) for row in rows}
+            self.loaded_version = version
+            self.loaded_at = time.monotonic()
+
+    async def get_all(self, session: AsyncSession) -> list[tuple[int, str]]:
+        await self.load(session)
+        return list(zip(self.ids, self.titles))
+
+    async def get_page(self, session: AsyncSession, limit=10, after=None, before=None) -> DepartmentsPage:
+        """  Keyset page of departments with ids greater than `after` or less than `before`  """
+        await self.load(session)
+        if before is not None:
+            stop = bisect_left(self.ids, before)
+            begin = max(stop - limit, 0)
+        else:
+            begin = bisect_right(self.ids, after) if after is not None else 0
+            stop = min(begin + limit, len(self.ids))
+        departments = tuple(zip(self.ids[begin:stop], self.titles[begin:stop]))
+        return DepartmentsPage(departments=departments, has_prev=begin > 0, has_next=stop < len(self.ids))
+
+    async def get_one(self, session: AsyncSession, department_id) -> Optional[tuple[str, Optional[str], Optional[str]]]:
+        await self.load(session)
+        return self.details.get(int(department_id))
+
+
+departments_cache = DepartmentsCache()
+
+
+class KnownUsersCache:
+    """
+    Short-lived set of users whose row in the users table is known to be up to date,
+    so repeated /start commands don't touch the database at all
+    """
+
+    def __init__(self, ttl: float = 600, maxsize: int = 100_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.users: dict[int, tuple[Optional[str], str, float]] = {}
+
+    def is_known(self, telegram_id: int, username: Optional[str], telegram_name: str) -> bool:
+        user = self.users.get(telegram_id)
+        if user is None:
+            return False
+        if user[2] < time.monotonic():
+            del self.users[telegram_id]
+            return False
+        return user[0] == username and user[1] == telegram_name
+
+    def remember(self, telegram_id: int, username: Optional[str], telegram_name: str):
+        self.users.pop(telegram_id, None)
+        if len(self.users) >= self.maxsize:
+            del self.users[next(iter(self.users))]  # The oldest entry, dicts keep insertion order
+        self.users[telegram_id] = (username, telegram_name, time.monotonic() + self.ttl)
+
+    def forget(self, telegram_id: int):
+        self.users.pop(telegram_id, None)
+
+
+known_users_cache = KnownUsersCache()
@@ -0,0 +1,169 @@
+import asyncio
+import enum
+import time
+from typing import Iterable, Optional
+
+from sqlalchemy import select, func, distinct, literal, cast, union_all, TEXT
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.models.models import Forms, FormsDepartments, Languages
+
+# Facets which are columns of the forms table
+COLUMN_FACETS = ("education", "living_conditions", "working_style", "origin", "business_trip", "military_service")
+FACETS = (*COLUMN_FACETS, "language_level", "department")
+
+# Filters are kept as {facet: [value, ...]}, values of one facet are OR-ed and facets are AND-ed
+Filters = dict[str, list[str]]
+
+
+def popcount(bitmap: int) -> int:
+    return bin(bitmap).count("1")  # The image runs Python 3.9, int.bit_count() is only available since 3.10
+
+
+def make_facet_value(value) -> str:
+    """  Values are kept as strings, so they can be stored in FSM data and callback data as is  """
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def make_form_facets(form: dict, department_ids: Iterable[int] = (), languages: Iterable[dict] = ()) -> Filters:
+    """  Facet values of a form in the same shape as filters  """
+    facets = {facet: [make_facet_value(form[facet])] for facet in COLUMN_FACETS}
+    facets["language_level"] = sorted({make_facet_value(language["level"]) for language in languages})
+    facets["department"] = [make_facet_value(department_id) for department_id in department_ids]
+    return facets
+
+
+def make_bitmap(form_ids: list[int]) -> int:
+    """  Set bits one by one in a byte array, OR-ing big integers per form would be quadratic  """
+    bits = bytearray(max(form_ids) // 8 + 1)
+    for form_id in form_ids:
+        bits[form_id >> 3] |= 1 << (form_id & 7)
+    return int.from_bytes(bits, "little")
+
+
+class FormFacetsIndex:
+    """
+    In-process bitmap index of forms by facet values, bit number N is set when form N has the value.
+    Counts for any combination of filters are popcounts of AND-ed bitmaps, so changing filters doesn't
+    query the database. New forms of this process are added incrementally, the index is reloaded
+    when the TTL expires to pick up forms added by other replicas
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.loaded_at: Optional[float] = None
+        self.all = 0
+        self.bitmaps: dict[str, dict[str, int]] = {facet: {} for facet in FACETS}
+        self.pending: Optional[list[tuple[int, Filters]]] = None  # Forms added while the index is loading
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def load(self, session: AsyncSession):
+        if self.is_fresh():
+            return
+        async with self.lock:
+            if self.is_fresh():
+                return
+            self.pending = []
+            try:
+                await self._load(session)
+                for form_id, facets in self.pending:
+                    self._add(form_id, facets)
+            finally:
+                self.pending = None
+
+    async def _load(self, session: AsyncSession):
+        # Postgres groups ids of forms by every facet value, so only a few dozen arrays are transferred and decoded
+        sources = [(facet, getattr(Forms, facet), Forms.form_id) for facet in COLUMN_FACETS]
+        sources.append(("language_level", Languages.level, Languages.form_id))
+        sources.append(("department", FormsDepartments.department_id, FormsDepartments.form_id))
+        query = union_all(*(
+            select(literal(facet).label("facet"), cast(column, TEXT).label("value"),
+                   func.array_agg(distinct(form_id)).label("form_ids")).group_by(column)
+            for facet, column, form_id in sources
+        ))
+        bitmaps = {facet: {} for facet in FACETS}
+        for facet, value, form_ids in await session.execute(query):
+            bitmaps[facet][value] = make_bitmap(form_ids)
+        self.all = 0
+        for bitmap in bitmaps["education"].values():  # Every form has an education
+            self.all |= bitmap
+        self.bitmaps = bitmaps
+        self.loaded_at = time.monotonic()
+
+    def add(self, form_id: int, facets: Filters):
+        """  Add a new form to the loaded index, a not loaded index will read it from the database  """
+        if self.pending is not None:
+            self.pending.append((form_id, facets))
+        elif self.loaded_at is not None:
+            self._add(form_id, facets)
+
+    def _add(self, form_id: int, facets: Filters):
+        bit = 1 << form_id
+        self.all |= bit
+        for facet, values in facets.items():
+            for value in values:
+                self.bitmaps[facet][value] = self.bitmaps[facet].get(value, 0) | bit
+
+    def match(self, filters: Filters, exclude: Optional[str] = None) -> int:
+        """  Bitmap of forms matching the filters, except the excluded facet  """
+        bitmap = self.all
+        for facet, values in filters.items():
+            if facet == exclude or not values:
+                continue
+            selected = 0
+            for value in values:
+                selected |= self.bitmaps[facet].get(value, 0)
+            bitmap &= selected
+        return bitmap
+
+    def count(self, filters: Filters) -> int:
+        return popcount(self.match(filters))
+
+    def get_counts(self, facet: str, filters: Filters) -> dict[str, int]:
+        """
+        Count of matching forms for every value of the facet.
+        Selected values of the facet itself are ignored, so counts show what choosing one more value gives
+        """
+        bitmap = self.match(filters, exclude=facet)
+        return {value: popcount(bitmap & value_bitmap) for value, value_bitmap in self.bitmaps[facet].items()}
+
+    def get_form_ids(self, filters: Filters, limit: int = 10) -> list[int]:
+        """  Ids of the newest matching forms  """
+        bitmap = self.match(filters)
+        form_ids = []
+        while bitmap and len(form_ids) < limit:
+            form_id = bitmap.bit_length() - 1
+            form_ids.append(form_id)
+            bitmap ^= 1 << form_id
+        return form_ids
+
+
+form_facets = FormFacetsIndex()
+
+
+async def get_facet_counts(session: AsyncSession, facet: str, filters: Filters) -> tuple[dict[str, int], int]:
+    """  :return: (count of forms for every value of the facet, count of forms matching the filters)  """
+    await form_facets.load(session)
+    return form_facets.get_counts(facet, filters), form_facets.count(filters)
+
+
+async def count_filtered_forms(session: AsyncSession, filters: Filters) -> int:
+    await form_facets.load(session)
+    return form_facets.count(filters)
+
+
+async def get_filtered_forms(session: AsyncSession, filters: Filters, limit=10) -> list:
+    """  :return: rows of form_id and full_name of the newest matching forms  """
+    await form_facets.load(session)
+    form_ids = form_facets.get_form_ids(filters, limit)
+    if not form_ids:
+        return []
+    query = select(Forms.form_id, Forms.full_name).where(Forms.form_id.in_(form_ids)).order_by(Forms.form_id.desc())
+    return (await session.execute(query)).all()
@@ -0,0 +1,184 @@
+import re
+import time
+from datetime import date
+from typing import Iterable, AsyncIterator, Optional
+
+from sqlalchemy import insert, update, select, func, literal, literal_column, or_, case, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.models.models import (Forms, Universities, WorkedCompanies, Trips, Languages, Applications,
+                                          FormsDepartments, Users, Departments, LivingConditionsEnum, EducationsEnum,
+                                          OriginsEnum, WorkingStylesEnum)
+from tgbot.database.functions.facets import form_facets, make_form_facets
+
+
+async def add_form(session: AsyncSession, telegram_id, form: dict, department_ids: Iterable[int] = (),
+                   universities: Iterable[dict] = (), companies: Iterable[dict] = (), trips: Iterable[dict] = (),
+                   languages: Iterable[dict] = (), applications: Iterable[dict] = ()) -> int:
+    """
+    Add a completed form with all its child rows in one transaction and link it to the user.
+    Child rows of each table are sent in one executemany call
+    :return: id of the new form
+    """
+    department_ids, languages = list(department_ids), list(languages)
+    universities, companies = list(universities), list(companies)
+    search_text = make_search_text(form["full_name"], form["address"],
+                                   *(university["name"] for university in universities),
+                                   *(company["name"] for company in companies))
+    try:
+        result = await session.execute(insert(Forms).values(**form, search_text=search_text).returning(
+            Forms.form_id))
+        form_id = result.scalar_one()
+        for table, rows in (
+                (FormsDepartments, [{"department_id": department_id} for department_id in department_ids]),
+                (Universities, universities),
+                (WorkedCompanies, companies),
+                (Trips, trips),
+                (Languages, languages),
+                (Applications, applications)
+        ):
+            rows = [{**row, "form_id": form_id} for row in rows]
+            if rows:
+                await session.execute(insert(table), rows)
+        await session.execute(update(Users).where(Users.telegram_id == telegram_id).values(form_id=form_id))
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    form_facets.add(form_id, make_form_facets(form, department_ids, languages))
+    return form_id
+
+
+def make_search_text(*values) -> str:
+    """  Text which applicants are searched by  """
+    return " ".join(value.strip() for value in values if value)
+
+
+# Levels of languages and applications are asked as separate questions of the form
+LANGUAGE_FIELDS = {"russian": "Rus tili", "english": "Ingliz tili", "chinese": "Xitoy tili"}
+APPLICATION_FIELDS = {"word": "Word", "excel": "Excel", "1c": "1C"}
+
+
+def make_form_rows(form: dict) -> dict:
+    """  Convert the answers collected in FSM data to keyword arguments of add_form, except department_ids  """
+    day, month, year = (int(number) for number in re.findall(r"\d+", form["birthday"]))
+    row = {
+        "full_name": form["full_name"],
+        "birth_date": date(year, month, day),
+        "phonenum": form["phonenum"],
+        "address": form["address"],
+        "living_conditions": LivingConditionsEnum[form["living_conditions"].upper()],
+        "education": EducationsEnum[form["education"].upper()],
+        "marital_status": form["marital_status"] == "married",
+        "business_trip": form["business_trip"] == "yes",
+        "military_service": form["military_service"] == "yes",
+        "criminal_record": form["criminal_record"],
+        "driver_license": form["driver_license"],
+        "personal_car": form["personal_car"],
+        "origin": OriginsEnum[form["origin"].upper()],
+        "salary_last_job": form["salary_last_job"],
+        "overwork_agreement": form["overwork_agreement"] == "yes",
+        "force_majeure_salary_agreement": form["force_majeure_salary_agreement"] == "yes",
+        "working_style": WorkingStylesEnum[form["working_style"].upper()],
+        "health": form["health"],
+        "photo_id": form["photo_id"],
+    }
+    return {
+        "form": row,
+        "universities": make_universities_rows(form.get("universities", [])),
+        "companies": make_companies_rows(form.get("companies", [])),
+        "trips": make_trips_rows(form.get("trips", [])),
+        "languages": make_levels_rows(form, LANGUAGE_FIELDS),
+        "applications": make_levels_rows(form, APPLICATION_FIELDS),
+    }
+
+
+def make_levels_rows(form: dict, fields: dict[str, str]) -> list[dict]:
+    """  Rows of languages or applications the applicant knows, level 0 means doesn't know  """
+    return [{"name": name, "level": int(form[field])} for field, name in fields.items() if int(form.get(field, 0))]
+
+
+def make_universities_rows(universities: list[dict]) -> list[dict]:
+    """  Convert universities collected in FSM data to rows of the universities table  """
+    return [{"name": university["name"], "faculty": university["direction"],
+             "finished_at": int(university["finished_year"])} for university in universities]
+
+
+def make_companies_rows(companies: list[dict]) -> list[dict]:
+    """  Convert companies collected in FSM data ("2018 - 2021" periods) to rows of the worked_companies table  """
+    rows = []
+    for company in companies:
+        started_year, finished_year = (int(year) for year in company["working_period"].split(" - "))
+        rows.append({"name": company["name"], "position": company["position"],
+                     "started_at": date(started_year, 1, 1), "finished_at": date(finished_year, 1, 1)})
+    return rows
+
+
+def make_trips_rows(trips: list[dict]) -> list[dict]:
+    """  Convert trips collected in FSM data to rows of the trips table, only the year of a trip is asked  """
+    return [{"country": trip["country"], "reason": trip["reason"], "traveled_at": date(int(trip["period"]), 1, 1)}
+            for trip in trips]
+
+
+def aggregate_children(table, *columns):
+    """  Correlated subquery which joins child rows of a form into one "a, b; c, d" string  """
+    item = func.concat_ws(", ", *columns)
+    return select(func.string_agg(item, literal("; "))).where(table.form_id == Forms.form_id).scalar_subquery()
+
+
+async def stream_forms_export(session: AsyncSession, batch_size=1000) -> AsyncIterator[list]:
+    """  Yield batches of forms with their departments and child tables, read through a server-side cursor  """
+    query = select(
+        *(column for column in Forms.__table__.columns if not column.name.startswith("search_")),
+        select(func.string_agg(Departments.title, literal(", "))).join(FormsDepartments).where(
+            FormsDepartments.form_id == Forms.form_id).scalar_subquery().label("departments"),
+        aggregate_children(Universities, Universities.name, Universities.faculty,
+                           Universities.finished_at).label("universities"),
+        aggregate_children(WorkedCompanies, WorkedCompanies.name, WorkedCompanies.position, WorkedCompanies.started_at,
+                           WorkedCompanies.finished_at).label("worked_companies"),
+        aggregate_children(Trips, Trips.country, Trips.reason, Trips.traveled_at).label("trips"),
+        aggregate_children(Languages, Languages.name, Languages.level).label("languages"),
+    ).order_by(Forms.form_id).execution_options(yield_per=batch_size)
+    result = await session.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+TRIGRAM_CHECK_INTERVAL = 600  # Seconds, pg_trgm may be installed or dropped while the bot is running
+trigram_search: Optional[bool] = None  # Whether pg_trgm is installed
+trigram_checked_at = 0.0
+
+
+async def has_trigram_search(session: AsyncSession) -> bool:
+    global trigram_search, trigram_checked_at
+    if trigram_search is None or time.monotonic() - trigram_checked_at > TRIGRAM_CHECK_INTERVAL:
+        trigram_search = bool(await session.scalar(text("SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'")))
+        trigram_checked_at = time.monotonic()
+    return trigram_search
+
+
+async def search_forms(session: AsyncSession, search_query: str, limit=5, offset=0):
+    """
+    Search applicants by words of full name, address, universities and companies, ranked by relevance.
+    Every word is matched as a prefix by full-text search, trigram similarity also finds misspelled words
+    if pg_trgm is installed. Both conditions are served by GIN indexes, matches are ranked in the same query
+    :return: (rows of form_id, full_name and rank, whether there are more results)
+    """
+    words = re.findall(r"\w+", search_query.lower())
+    if not words:
+        return [], False
+    ts_query = func.to_tsquery(literal_column("'simple'"), " & ".join(f"{word}:*" for word in words))
+    full_text_match = Forms.search_vector.op("@@")(ts_query)
+    # Normalization 32 maps ts_rank to rank / (rank + 1), so forms with all the words rank in [1, 2)
+    # and always above forms found only by similarity of misspelled words, which is in [0, 1]
+    rank = case((full_text_match, 1 + func.ts_rank(Forms.search_vector, ts_query, 32)), else_=0)
+    condition = full_text_match
+    if await has_trigram_search(session):
+        search_query = " ".join(words)
+        condition = or_(full_text_match, literal(search_query).op("<%")(Forms.search_text))
+        rank = func.greatest(rank, func.word_similarity(search_query, Forms.search_text))
+    rank = rank.label("rank")
+    query = select(Forms.form_id, Forms.full_name, rank).where(condition).order_by(
+        rank.desc(), Forms.form_id).limit(limit + 1).offset(offset)
+    rows = (await session.execute(query)).all()
+    return rows[:limit], len(rows) > limit
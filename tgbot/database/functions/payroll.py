@@ -0,0 +1,153 @@
+from datetime import date
+from typing import Iterable, Optional, Union, AsyncIterable, NamedTuple
+
+from sqlalchemy import (insert, select, delete, func, union_all, literal_column, cast, text, exists, DATE,
+                        table as sa_table, column as sa_column)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.models.models import Users, Salaries, Fines, Bonuses, PayrollRollups
+
+# Payroll table -> (rollup column, time column which defines the month)
+PAYROLL_TABLES = {
+    Salaries: ("salaries", Salaries.given_at),
+    Fines: ("fines", Fines.given_at),
+    Bonuses: ("bonuses", Bonuses.created_at),
+}
+
+
+def month_start(moment: date) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def truncate_to_month(column):
+    return cast(func.date_trunc(literal_column("'month'"), column), DATE)
+
+
+def make_payroll_insert(table, records_insert):
+    """  Wrap an insert of salaries, fines or bonuses into a statement which also adds their amounts to the rollups  """
+    column, time_column = PAYROLL_TABLES[table]
+    inserted = records_insert.returning(table.user_id, table.amount, time_column.label("moment")).cte("inserted")
+    month = truncate_to_month(inserted.c.moment)
+    totals = select(month, inserted.c.user_id, func.sum(inserted.c.amount)).group_by(month, inserted.c.user_id)
+    query = pg_insert(PayrollRollups).from_select(["month", "user_id", column], totals).add_cte(inserted)
+    return query.on_conflict_do_update(
+        index_elements=[PayrollRollups.month, PayrollRollups.user_id],
+        set_={column: getattr(PayrollRollups, column) + getattr(query.excluded, column)}
+    )
+
+
+async def add_payroll_records(session: AsyncSession, table, rows: Iterable[dict]) -> int:
+    """
+    Insert salaries, fines or bonuses and add their amounts to monthly rollups in one statement,
+    so the rollups can't drift from the records. All rows must have the same keys
+    :return: count of inserted records
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    await session.execute(make_payroll_insert(table, insert(table).values(rows)))
+    await session.commit()
+    return len(rows)
+
+
+class CopiedPayroll(NamedTuple):
+    imported: int
+    rejected: int  # Records of users who don't exist
+    rejected_lines: list[tuple[int, int]]  # First rejected records as (line, user_id)
+
+
+async def copy_payroll_records(session: AsyncSession, table, columns: list[str],
+                               records: Union[Iterable[tuple], AsyncIterable[tuple]],
+                               max_rejected_lines=20) -> CopiedPayroll:
+    """
+    Load a large amount of salaries, fines or bonuses in one transaction.
+    Records are streamed with COPY to a temporary table, records of existing users are moved with their rollups
+    by one statement, and the rest are counted by an anti-join, so user ids are checked by Postgres.
+    Every record starts with its line number in the source, followed by values of the columns
+    """
+    try:
+        await session.execute(text(f"CREATE TEMPORARY TABLE payroll_import ON COMMIT DROP AS "
+                                   f"SELECT 0 AS line, {', '.join(columns)} FROM {table.__tablename__} WITH NO DATA"))
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        status = await raw_connection.driver_connection.copy_records_to_table("payroll_import", records=records,
+                                                                              columns=["line", *columns])
+        copied = int(status.split()[-1])  # Status of COPY looks like "COPY 100000"
+        payroll_import = sa_table("payroll_import", sa_column("line"), *(sa_column(name) for name in columns))
+        unknown_user = ~exists().where(Users.telegram_id == payroll_import.c.user_id)
+        rejected = await session.scalar(select(func.count()).select_from(payroll_import).where(unknown_user))
+        rejected_lines = (await session.execute(
+            select(payroll_import.c.line, payroll_import.c.user_id).where(unknown_user).order_by(
+                payroll_import.c.line).limit(max_rejected_lines))).all()
+        records_insert = insert(table).from_select(columns, select(*(payroll_import.c[name] for name in columns)).join(
+            Users, Users.telegram_id == payroll_import.c.user_id))
+        await session.execute(make_payroll_insert(table, records_insert))
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    return CopiedPayroll(copied - rejected, rejected, [tuple(row) for row in rejected_lines])
+
+
+async def add_salary(session: AsyncSession, user_id, assigner_id, amount, given_at=None):
+    """  Give a salary to the employee  """
+    row = {"user_id": user_id, "assigner_id": assigner_id, "amount": amount}
+    if given_at:
+        row["given_at"] = given_at
+    await add_payroll_records(session, Salaries, [row])
+
+
+async def add_fine(session: AsyncSession, user_id, assigner_id, amount, given_at=None):
+    """  Fine the employee  """
+    row = {"user_id": user_id, "assigner_id": assigner_id, "amount": amount}
+    if given_at:
+        row["given_at"] = given_at
+    await add_payroll_records(session, Fines, [row])
+
+
+async def add_bonus(session: AsyncSession, user_id, assigner_id, amount, title, description=None):
+    """  Give a bonus to the employee  """
+    await add_payroll_records(session, Bonuses, [{"user_id": user_id, "assigner_id": assigner_id, "amount": amount,
+                                                  "title": title, "description": description}])
+
+
+def make_payroll_query(month: date):
+    net = PayrollRollups.salaries + PayrollRollups.bonuses - PayrollRollups.fines
+    return select(PayrollRollups.user_id, Users.telegram_name, PayrollRollups.salaries, PayrollRollups.fines,
+                  PayrollRollups.bonuses, net.label("net")).join(Users).where(
+        PayrollRollups.month == month_start(month)).order_by(Users.telegram_name)
+
+
+async def get_payroll(session: AsyncSession, month: date):
+    """  Get salaries, fines, bonuses and net pay of every employee for the month  """
+    result = await session.execute(make_payroll_query(month))
+    return result.all()
+
+
+async def get_employee_payroll(session: AsyncSession, user_id, since: date, until: Optional[date] = None):
+    """  Get monthly salaries, fines, bonuses and net pay of the employee for the period  """
+    net = PayrollRollups.salaries + PayrollRollups.bonuses - PayrollRollups.fines
+    query = select(PayrollRollups.month, PayrollRollups.salaries, PayrollRollups.fines, PayrollRollups.bonuses,
+                   net.label("net")).where(PayrollRollups.user_id == user_id,
+                                           PayrollRollups.month >= month_start(since))
+    if until:
+        query = query.where(PayrollRollups.month <= month_start(until))
+    result = await session.execute(query.order_by(PayrollRollups.month))
+    return result.all()
+
+
+async def rebuild_payroll_rollups(session: AsyncSession):
+    """  Recalculate all rollups from salaries, fines and bonuses, e.g. after they were changed by hand  """
+    columns = [column for column, _ in PAYROLL_TABLES.values()]
+    records = union_all(*(
+        select(truncate_to_month(time_column).label("month"), table.user_id.label("user_id"),
+               *((func.sum(table.amount) if name == column else literal_column("0")).label(name) for name in columns)
+               ).group_by(truncate_to_month(time_column), table.user_id)
+        for table, (column, time_column) in PAYROLL_TABLES.items()
+    )).subquery()
+    totals = select(records.c.month, records.c.user_id, *(func.sum(records.c[name]) for name in columns)).group_by(
+        records.c.month, records.c.user_id)
+    await session.execute(delete(PayrollRollups))
+    await session.execute(insert(PayrollRollups).from_select(["month", "user_id", *columns], totals))
+    await session.commit()
@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+PARAMETER_RE = re.compile(r"\$\d+|%s|%\(\w+\)s|\b\d+(?:\.\d+)?\b")
+LIST_RE = re.compile(r"\((?:\?, )+\?\)")
+ROWS_RE = re.compile(r"\(\?\)(?:, \(\?\))+")
+SPACES_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str) -> str:
+    """  Replace literals and parameters with "?" and collapse lists of them, so similar queries are grouped  """
+    statement = SPACES_RE.sub(" ", statement).strip()
+    statement = PARAMETER_RE.sub("?", STRING_RE.sub("?", statement))
+    return ROWS_RE.sub("(?)", LIST_RE.sub("(?)", statement))
+
+
+@dataclass
+class StatementStats:
+    count: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    slow: int = 0
+
+
+@dataclass
+class RepeatedStatement:
+    handler: str
+    statement: str
+    updates: int = 0  # Updates which ran the statement repeatedly
+    max_repeats: int = 0
+
+
+class QueryProfiler:
+    """
+    Times every statement of the engine and groups them by normalized SQL.
+    Statements slower than the threshold are logged, and a handler which runs the same statement
+    several times for one update is flagged as a possible N+1 query
+    """
+
+    def __init__(self, slow_query_threshold: float = 0.1, repeated_query_threshold: int = 3,
+                 max_statements: int = 1000):
+        self.enabled = False
+        self.slow_query_threshold = slow_query_threshold
+        self.repeated_query_threshold = repeated_query_threshold
+        self.max_statements = max_statements
+        self.started_at = time.monotonic()
+        self.statements: dict[str, StatementStats] = {}
+        self.repeated: dict[tuple[str, str], RepeatedStatement] = {}
+        self.update_statements: ContextVar[Optional[Counter]] = ContextVar("update_statements", default=None)
+
+    def instrument(self, engine: AsyncEngine):
+        self.enabled = True
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("profiler_started_at", []).append(time.perf_counter())
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.record(statement, time.perf_counter() - conn.info["profiler_started_at"].pop())
+
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def handle_error(exception_context):
+            started_at = exception_context.connection.info.get("profiler_started_at") \
+                if exception_context.connection is not None else None
+            if started_at:
+                started_at.pop()
+
+    def record(self, statement: str, elapsed: float):
+        normalized = normalize_statement(statement)
+        stats = self.statements.get(normalized)
+        if stats is None:
+            if len(self.statements) >= self.max_statements:
+                normalized = "(other statements)"
+            stats = self.statements.setdefault(normalized, StatementStats())
+        stats.count += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+        if elapsed >= self.slow_query_threshold:
+            stats.slow += 1
+            logging.warning("Slow query %.1f ms: %s", elapsed * 1000, SPACES_RE.sub(" ", statement)[:1000])
+        update_statements = self.update_statements.get()
+        if update_statements is not None:
+            update_statements[normalized] += 1
+
+    @contextmanager
+    def track_update(self, handler: str):
+        """  Count statements run while the handler processes an update and flag repeated ones  """
+        statements = Counter()
+        token = self.update_statements.set(statements)
+        try:
+            yield
+        finally:
+            self.update_statements.reset(token)
+            for statement, count in statements.items():
+                if count >= self.repeated_query_threshold:
+                    self.flag_repeated(handler, statement, count)
+
+    def flag_repeated(self, handler: str, statement: str, count: int):
+        repeated = self.repeated.get((handler, statement))
+        if repeated is None:
+            repeated = self.repeated[handler, statement] = RepeatedStatement(handler, statement)
+            logging.warning("Possible N+1 query, %s ran %d times: %s", handler, count, statement[:1000])
+        repeated.updates += 1
+        repeated.max_repeats = max(repeated.max_repeats, count)
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.statements.clear()
+        self.repeated.clear()
+
+    def get_top_statements(self, limit=10) -> list[tuple[str, StatementStats]]:
+        return sorted(self.statements.items(), key=lambda item: item[1].total_time, reverse=True)[:limit]
+
+    def get_repeated_statements(self, limit=10) -> list[RepeatedStatement]:
+        return sorted(self.repeated.values(), key=lambda repeated: repeated.updates, reverse=True)[:limit]
+
+
+query_profiler = QueryProfiler()
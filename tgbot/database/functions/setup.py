@@ -1,20 +1,112 @@
+import time
+from dataclasses import dataclass
 from typing import Callable
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from tgbot.config import DbConfig
+from tgbot.database.functions.profiler import query_profiler
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    checkout_time: float = 0.0
+    checkout_time_max: float = 0.0
+    waits: int = 0  # Checkouts which found neither an idle connection nor room for an overflow one
+    wait_time: float = 0.0
+    connects: int = 0
+    connect_time: float = 0.0
+    overflow_max: int = 0
+
+
+class MeasuredQueuePool(AsyncAdaptedQueuePool):
+    """  Queue pool which measures checkout latency, waiting for a free connection and overflow usage  """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        # Below size + max_overflow a missing idle connection is opened at once, only at the limit a checkout waits
+        at_limit = self._max_overflow > -1 and self.overflow() >= self._max_overflow
+        must_wait = not self.checkedin() and at_limit
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.metrics.checkouts += 1
+            self.metrics.checkout_time += elapsed
+            self.metrics.checkout_time_max = max(self.metrics.checkout_time_max, elapsed)
+            self.metrics.overflow_max = max(self.metrics.overflow_max, self.overflow())
+            if must_wait:
+                self.metrics.waits += 1
+                self.metrics.wait_time += elapsed
+
+    def _create_connection(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            self.metrics.connects += 1
+            self.metrics.connect_time += time.perf_counter() - started_at
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def get_stats(self) -> dict:
+        """  Current state of the pool and collected metrics  """
+        metrics = self.metrics
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "overflow_max": max(metrics.overflow_max, 0),
+            "connects": metrics.connects,
+            "connect_avg_ms": metrics.connect_time / metrics.connects * 1000 if metrics.connects else 0,
+            "checkouts": metrics.checkouts,
+            "checkout_avg_ms": metrics.checkout_time / metrics.checkouts * 1000 if metrics.checkouts else 0,
+            "checkout_max_ms": metrics.checkout_time_max * 1000,
+            "waits": metrics.waits,
+            "wait_avg_ms": metrics.wait_time / metrics.waits * 1000 if metrics.waits else 0,
+        }
 
 
 async def create_session_pool(db: DbConfig, echo=False) -> Callable[[], AsyncSession]:
     async_engine = create_async_engine(
         db.construct_sqlalchemy_url(),
         query_cache_size=1200,
-        pool_size=20,
-        max_overflow=200,
+        poolclass=MeasuredQueuePool,
+        pool_size=db.pool_size,
+        max_overflow=db.max_overflow,
+        pool_timeout=db.pool_timeout,
+        pool_recycle=db.pool_recycle,
+        pool_pre_ping=db.pool_pre_ping,
+        # The asyncpg dialect prepares every statement itself and caches them in prepared_statement_cache_size,
+        # asyncpg's own statement_cache_size only covers its internal queries. Either way statements are named,
+        # so pgbouncer in transaction mode needs max_prepared_statements > 0 (pgbouncer 1.21+) or session mode
+        connect_args={"prepared_statement_cache_size": db.statement_cache_size,
+                      "statement_cache_size": db.statement_cache_size, "timeout": db.connect_timeout},
         future=True,
         echo=echo
 
     )
+    if db.profile:
+        query_profiler.slow_query_threshold = db.slow_query_ms / 1000
+        query_profiler.instrument(async_engine)
     session_pool = sessionmaker(bind=async_engine, expire_on_commit=False, class_=AsyncSession)
     return session_pool
+
+
+def get_pool_stats(session_pool: Callable[[], AsyncSession]) -> dict:
+    """  Pool metrics of the engine behind the session pool  """
+    pool = session_pool.kw["bind"].sync_engine.pool
+    if isinstance(pool, MeasuredQueuePool):
+        return pool.get_stats()
+    return {"status": pool.status()}
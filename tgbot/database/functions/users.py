@@ -1,19 +1,30 @@
 import logging
 from contextlib import suppress
 
-from sqlalchemy import insert, select, text, delete
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, text, delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession, AsyncResult
 
 from tgbot.database.models.models import Users, Departments
+from tgbot.database.functions.cache import departments_cache, DepartmentsPage, known_users_cache
 
 
 async def add_user(session: AsyncSession, telegram_id, username, telegram_name):
-    """  Add user to database  """
-    query = insert(Users).values(telegram_id=telegram_id, username=username, telegram_name=telegram_name)
+    """  Add user to database or refresh his username and name, users seen recently are skipped  """
+    if known_users_cache.is_known(telegram_id, username, telegram_name):
+        return
+    query = pg_insert(Users).values(telegram_id=telegram_id, username=username, telegram_name=telegram_name)
+    query = query.on_conflict_do_update(
+        index_elements=[Users.telegram_id],
+        set_={"username": query.excluded.username, "telegram_name": query.excluded.telegram_name},
+        # Unchanged rows are not rewritten
+        where=or_(Users.username.is_distinct_from(query.excluded.username),
+                  Users.telegram_name != query.excluded.telegram_name)
+    )
     await session.execute(query)
-    with suppress(IntegrityError):
-        await session.commit()
+    await session.commit()
+    known_users_cache.remember(telegram_id, username, telegram_name)
 
 
 async def add_department(session: AsyncSession, title, description=None, photo_id=None):
@@ -22,33 +33,25 @@ async def add_department(session: AsyncSession, title, description=None, photo_i
     await session.execute(query)
     with suppress(IntegrityError):
         await session.commit()
+    departments_cache.invalidate()
 
 
 async def get_all_departments(session: AsyncSession):
     """  Get all departments' ids and titles  """
-    query = select(Departments.department_id, Departments.title)
-    result = await session.execute(query)
-    return result.all()
+    return await departments_cache.get_all(session)
 
 
-async def get_departments(session: AsyncSession, limit=None, start=1, end=None):
-    """  Get departments' ids and titles by clause  """
-    if end:
-        subquery = select(Departments.department_id.label("d_id"), Departments.title).where(Departments.department_id <= end).limit(
-            limit).order_by(Departments.department_id.desc()).subquery()
-        query = select(subquery).order_by(subquery.c.d_id)
-    else:
-        query = select(Departments.department_id, Departments.title).where(Departments.department_id >= start).limit(limit)
-    result = await session.execute(query)
-    return result.all()
+async def get_departments_page(session: AsyncSession, limit=10, after=None, before=None) -> DepartmentsPage:
+    """  Get a page of departments' ids and titles after or before the given department id  """
+    return await departments_cache.get_page(session, limit=limit, after=after, before=before)
 
 
 async def get_department(session: AsyncSession, department_id):
     """  Get a department from database by its id  """
-    query = select(Departments.title, Departments.description, Departments.photo_id).where(
-        Departments.department_id == department_id)
-    result = await session.execute(query)
-    return result.one()
+    department = await departments_cache.get_one(session, department_id)
+    if department is None:
+        raise NoResultFound("No row was found when one was required")
+    return department
 
 
 async def delete_department(session: AsyncSession, department_id):
@@ -56,3 +59,4 @@ async def delete_department(session: AsyncSession, department_id):
     query = delete(Departments).where(Departments.department_id == department_id)
     await session.execute(query)
     await session.commit()
+    departments_cache.invalidate()
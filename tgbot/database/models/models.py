@@ -1,7 +1,8 @@
 import enum
 
 from sqlalchemy import (Column, BIGINT, INTEGER, SMALLINT, VARCHAR, TEXT, TIMESTAMP, DATE, ForeignKey, BOOLEAN, func,
-                        Enum)
+                        Enum, Computed, Index, DDL, event, text)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from .base import Base
 
 
@@ -55,7 +56,28 @@ class Forms(Base):
     working_style = Column(Enum(WorkingStylesEnum), nullable=False)
     health = Column(VARCHAR(255), nullable=False)
     photo_id = Column(TEXT, nullable=False)
-    registered_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    registered_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
+    # Full name, address, universities and companies of the applicant, filled by add_form
+    search_text = Column(TEXT, server_default="", nullable=False)
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('simple', search_text)", persisted=True))
+
+    __table_args__ = (
+        Index("ix_forms_search_vector", search_vector, postgresql_using="gin"),
+    )
+
+
+def has_pg_trgm(ddl, target, bind, **kwargs) -> bool:
+    """  pg_trgm is shipped with contrib packages of Postgres, which are not installed everywhere  """
+    return bool(bind.scalar(text("SELECT count(*) FROM pg_available_extensions WHERE name = 'pg_trgm'")))
+
+
+# Trigram index of misspelled words is created only where pg_trgm is available, search works without it too.
+# It is kept out of the metadata, alembic/env.py excludes it from autogenerate
+TRIGRAM_INDEX = "ix_forms_search_text_trgm"
+event.listen(Forms.__table__, "after_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+    callable_=has_pg_trgm))
+event.listen(Forms.__table__, "after_create", DDL(
+    f"CREATE INDEX {TRIGRAM_INDEX} ON forms USING gin (search_text gin_trgm_ops)").execute_if(callable_=has_pg_trgm))
 
 
 class Departments(Base):
@@ -71,14 +93,15 @@ class FormsDepartments(Base):
     __tablename__ = "forms_departments"
 
     form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), primary_key=True)
-    department_id = Column(SMALLINT, ForeignKey("departments.department_id", ondelete="RESTRICT"), primary_key=True)
+    department_id = Column(SMALLINT, ForeignKey("departments.department_id", ondelete="RESTRICT"), primary_key=True,
+                           index=True)
 
 
 class SelfAssessment(Base):
     __tablename__ = "self_assessment"
 
     assessment_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False, index=True)
     type = Column(VARCHAR(32), nullable=False)
     text = Column(TEXT, nullable=False)
 
@@ -87,7 +110,8 @@ class Universities(Base):
     __tablename__ = "universities"
 
     university_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), primary_key=True, nullable=False,
+                     index=True)
     name = Column(VARCHAR(255), nullable=False)
     faculty = Column(VARCHAR(255), nullable=False)
     finished_at = Column(SMALLINT, nullable=False)
@@ -97,7 +121,7 @@ class WorkedCompanies(Base):
     __tablename__ = "worked_companies"
 
     company_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(VARCHAR(255), nullable=False)
     position = Column(VARCHAR(255), nullable=False)
     started_at = Column(DATE, nullable=False)
@@ -108,7 +132,7 @@ class Trips(Base):
     __tablename__ = "trips"
 
     trip_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False, index=True)
     country = Column(VARCHAR(255), nullable=False)
     reason = Column(VARCHAR(255), nullable=False)
     traveled_at = Column(DATE, nullable=False)
@@ -118,7 +142,7 @@ class Languages(Base):
     __tablename__ = "languages"
 
     language_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(VARCHAR(32), nullable=False)
     level = Column(SMALLINT, nullable=False)
 
@@ -127,7 +151,7 @@ class Applications(Base):
     __tablename__ = "applications"
 
     application_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False)
+    form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(VARCHAR(32), nullable=False)
     level = Column(SMALLINT, nullable=False)
 
@@ -140,53 +164,53 @@ class Users(Base):
     telegram_name = Column(VARCHAR(255), nullable=False)
     form_id = Column(INTEGER, ForeignKey("forms.form_id", ondelete="SET NULL"), unique=True, nullable=True)
     is_employee = Column(BOOLEAN, server_default="FALSE")
-    registered_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    registered_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
 
 
 class Salaries(Base):
     __tablename__ = "salaries"
 
     salary_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     amount = Column(INTEGER, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
-    given_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    given_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
 
 
 class Fines(Base):
     __tablename__ = "fines"
 
     fine_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     amount = Column(INTEGER, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
-    given_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    given_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
 
 
 class Bonuses(Base):
     __tablename__ = "bonuses"
 
     bonus_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     amount = Column(INTEGER, nullable=False)
     title = Column(VARCHAR(255), nullable=False)
     description = Column(TEXT, nullable=True)
-    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
 
 
 class Tasks(Base):
     __tablename__ = "tasks"
 
     task_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    assigner_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     title = Column(VARCHAR(255), nullable=False)
     description = Column(TEXT, nullable=True)
     status = Column(VARCHAR(32), nullable=False)
-    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
     finished_at = Column(TIMESTAMP, nullable=True)
 
 
@@ -194,17 +218,45 @@ class Appreciations(Base):
     __tablename__ = "appreciations"
 
     appreciation_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    sender_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    sender_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     text = Column(TEXT, nullable=True)
-    sent_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    sent_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
 
 
 class Complaints(Base):
     __tablename__ = "complaints"
 
     complaint_id = Column(INTEGER, primary_key=True, autoincrement=True)
-    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False)
-    sender_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False)
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), nullable=False, index=True)
+    sender_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=False, index=True)
     text = Column(TEXT, nullable=True)
-    sent_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    sent_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
+
+
+class BroadcastJobs(Base):
+    __tablename__ = "broadcast_jobs"
+
+    job_id = Column(INTEGER, primary_key=True, autoincrement=True)
+    creator_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="SET NULL"), nullable=True, index=True)
+    text = Column(TEXT, nullable=False)
+    status = Column(VARCHAR(32), server_default="PENDING", nullable=False)
+    total = Column(INTEGER, server_default="0", nullable=False)
+    sent = Column(INTEGER, server_default="0", nullable=False)
+    failed = Column(INTEGER, server_default="0", nullable=False)
+    last_user_id = Column(BIGINT, server_default="0", nullable=False)  # Keyset checkpoint of processed recipients
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    started_at = Column(TIMESTAMP, nullable=True)
+    finished_at = Column(TIMESTAMP, nullable=True)
+    claimed_by = Column(VARCHAR(64), nullable=True)  # Replica which runs the job, see claim_broadcast_job
+    heartbeat_at = Column(TIMESTAMP, nullable=True)  # Renewed by checkpoints, an old one means a stopped replica
+
+
+class PayrollRollups(Base):
+    __tablename__ = "payroll_rollups"
+
+    month = Column(DATE, primary_key=True)  # First day of the month, updated together with salaries/fines/bonuses
+    user_id = Column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True, index=True)
+    salaries = Column(BIGINT, server_default="0", nullable=False)
+    fines = Column(BIGINT, server_default="0", nullable=False)
+    bonuses = Column(BIGINT, server_default="0", nullable=False)
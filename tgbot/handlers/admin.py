@@ -1,25 +1,313 @@
+import csv
 import logging
+import os
+import tempfile
+import time
+from html import escape
+from datetime import datetime
+from typing import Callable
 
-from aiogram import Router
-from aiogram.types import Message
+from aiogram import Router, Bot, F
+from aiogram.filters import CommandObject
+from aiogram.types import Message, ContentType, FSInputFile, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from tgbot.keyboards.reply import admin_menu
+from tgbot.keyboards.inline import (make_search_keyboard, make_facets_keyboard, make_facet_values_keyboard,
+                                    FACET_TITLES, FACET_VALUE_TITLES)
+from tgbot.misc.cbdata import MainCallbackFactory
 from tgbot.filters.admin import AdminFilter
-from tgbot.database.functions.users import add_user
-from tgbot.database.models.models import Users
+from tgbot.database.functions.users import add_user, get_all_departments
+from tgbot.database.functions.broadcasts import add_broadcast_job, get_last_broadcast_jobs
+from tgbot.database.functions.setup import get_pool_stats
+from tgbot.database.functions.profiler import query_profiler
+from tgbot.database.functions.payroll import get_payroll
+from tgbot.database.functions.forms import search_forms
+from tgbot.database.functions.facets import get_facet_counts, count_filtered_forms, get_filtered_forms
+from tgbot.database.models.models import Forms
+from tgbot.services.broadcaster import start_broadcast_job
+from tgbot.services.payroll_import import import_payroll_csv, PAYROLL_IMPORTS
+from tgbot.services.export import export_forms, EXPORT_FORMATS
 
 
-admin_router = Router()
+admin_router = Router(name="admin")
 admin_router.message.filter(AdminFilter())
 
 
 @admin_router.message(AdminFilter(is_admin=True), commands="start", state="*")
 async def admin_start(message: Message, state: FSMContext, session: AsyncSession):
     await state.clear()
-    user = await session.get(Users, message.from_user.id)
-    if not user:
-        await add_user(session=session, telegram_id=message.from_user.id, username=message.from_user.username,
-                       telegram_name=message.from_user.full_name)
+    await add_user(session=session, telegram_id=message.from_user.id, username=message.from_user.username,
+                   telegram_name=message.from_user.full_name)
     await message.answer(f"Assalamu Alaykum {message.from_user.full_name}!", reply_markup=admin_menu)
+
+
+@admin_router.message(commands="broadcast")
+async def start_broadcast(message: Message, command: CommandObject, bot: Bot, session: AsyncSession,
+                          session_pool: Callable[[], AsyncSession]):
+    """  Create a broadcast job for all users and start sending it in background  """
+    if not command.args:
+        await message.answer("Xabar matnini buyruqdan keyin yozing:\n/broadcast <i>matn</i>")
+        return
+    job_id = await add_broadcast_job(session, text=command.args, creator_id=message.from_user.id)
+    start_broadcast_job(bot, session_pool, job_id)
+    await message.answer(f"<b>Xabar yuborish boshlandi!</b> (ID: {job_id})\nHolatini /broadcasts orqali kuzating.")
+
+
+@admin_router.message(commands="broadcasts")
+async def show_broadcasts(message: Message, session: AsyncSession):
+    """  Show progress, throughput and ETA of the latest broadcast jobs  """
+    jobs = await get_last_broadcast_jobs(session)
+    if not jobs:
+        await message.answer("<u><b>Xabar yuborishlar yo'q!</b></u>")
+        return
+    text = "<b>Oxirgi xabar yuborishlar:</b>\n"
+    for job, elapsed in jobs:
+        processed = job.sent + job.failed
+        text += f"\n<b>ID {job.job_id}</b> - {job.status}\n{processed}/{job.total} " \
+                f"(\U00002705 {job.sent}, \U0000274C {job.failed})\n"
+        if job.status == "RUNNING" and elapsed and processed:
+            speed = processed / float(elapsed) if elapsed > 0 else 0
+            if speed:
+                text += f"{speed:.1f} xabar/s, taxminan {int((job.total - processed) / speed)} s qoldi\n"
+    await message.answer(text)
+
+
+@admin_router.message(commands="db_pool")
+async def show_db_pool(message: Message, session_pool: Callable[[], AsyncSession]):
+    """  Show connection pool usage of this bot process  """
+    text = "<b>Ma'lumotlar bazasi ulanishlari:</b>\n"
+    for name, value in get_pool_stats(session_pool).items():
+        text += f"{name}: {round(value, 2) if isinstance(value, float) else value}\n"
+    await message.answer(text)
+
+
+@admin_router.message(commands="sql_profile")
+async def show_sql_profile(message: Message, command: CommandObject):
+    """  Show the slowest and repeated queries collected by the query profiler: /sql_profile [reset]  """
+    if not query_profiler.enabled:
+        await message.answer("Profiling o'chirilgan, yoqish uchun DB_PROFILE=True qiling")
+        return
+    if command.args and command.args.strip() == "reset":
+        query_profiler.reset()
+        await message.answer("Profiling statistikasi tozalandi")
+        return
+    minutes = (time.monotonic() - query_profiler.started_at) / 60
+    lines = [f"<b>So'rovlar, oxirgi {minutes:.0f} daqiqa:</b>\n"]
+    for statement, stats in query_profiler.get_top_statements():
+        lines.append(f"\n<b>{stats.count}x</b>, jami {stats.total_time * 1000:.0f} ms, "
+                     f"o'rtacha {stats.total_time / stats.count * 1000:.1f} ms, max {stats.max_time * 1000:.1f} ms"
+                     f"{f', sekin: {stats.slow}' if stats.slow else ''}\n<code>{escape(statement[:500])}</code>\n")
+    repeated_statements = query_profiler.get_repeated_statements()
+    if repeated_statements:
+        lines.append("\n<b>Takrorlanuvchi so'rovlar (N+1):</b>\n")
+    for repeated in repeated_statements:
+        lines.append(f"\n<b>{repeated.handler}</b>: {repeated.updates} ta update, "
+                     f"{repeated.max_repeats} martagacha\n<code>{escape(repeated.statement[:500])}</code>\n")
+    text = ""
+    for line in lines:
+        if len(text) + len(line) > 4096:  # Telegram's limit of a message length
+            await message.answer(text)
+            text = ""
+        text += line
+    await message.answer(text)
+
+
+@admin_router.message(commands="payroll")
+async def show_payroll(message: Message, command: CommandObject, session: AsyncSession):
+    """  Show salaries, fines, bonuses and net pay of employees for the month: /payroll [YYYY-MM]  """
+    try:
+        month = datetime.strptime(command.args.strip(), "%Y-%m") if command.args else datetime.now()
+    except ValueError:
+        await message.answer("Oyni YYYY-MM ko'rinishida yozing:\n/payroll <i>2022-09</i>")
+        return
+    payroll = await get_payroll(session, month)
+    if not payroll:
+        await message.answer(f"<u><b>{month:%Y-%m} uchun hisob-kitoblar yo'q!</b></u>")
+        return
+    text = f"<b>{month:%Y-%m} oylik hisobot:</b>\n"
+    for row in payroll:
+        line = f"\n<b>{escape(row.telegram_name)}</b>: {row.net}\n" \
+               f"(Maosh {row.salaries}, jarima {row.fines}, bonus {row.bonuses})\n"
+        if len(text) + len(line) > 4096:  # Telegram's limit of a message length
+            await message.answer(text)
+            text = ""
+        text += line
+    await message.answer(text)
+
+
+@admin_router.message(commands="import", content_types=[ContentType.TEXT, ContentType.DOCUMENT])
+async def import_payroll(message: Message, command: CommandObject, bot: Bot, session: AsyncSession):
+    """  Import salaries, fines or bonuses from CSV file sent with caption: /import salaries|fines|bonuses  """
+    kind = (command.args or "").strip()
+    if not message.document or kind not in PAYROLL_IMPORTS:
+        await message.answer("CSV faylni quyidagi izoh bilan yuboring:\n/import <i>salaries|fines|bonuses</i>\n\n"
+                             "Ustunlar: user_id, amount, given_at (salaries, fines) yoki "
+                             "user_id, amount, title, description (bonuses)")
+        return
+    with tempfile.TemporaryFile() as file:
+        await bot.download(message.document, destination=file)
+        try:
+            result = await import_payroll_csv(session, kind, file, assigner_id=message.from_user.id)
+        except (ValueError, csv.Error) as e:
+            await message.answer(f"<b>Fayl yuklanmadi!</b>\n{escape(str(e))}")
+            return
+    text = f"<b>Yuklandi:</b> {result.imported}\n<b>Xatolar:</b> {result.failed}\n"
+    for line, reason in result.errors:
+        text += f"{line}-qator: {escape(reason)}\n"
+    await message.answer(text)
+
+
+@admin_router.message(commands="export")
+async def export_applications(message: Message, command: CommandObject, session: AsyncSession):
+    """  Send all forms with their child tables as a file: /export [csv|xlsx]  """
+    file_format = (command.args or "csv").strip().lower()
+    if file_format not in EXPORT_FORMATS:
+        await message.answer("Fayl turini tanlang:\n/export <i>csv|xlsx</i>")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"anketalar_{datetime.now():%Y-%m-%d}.{file_format}")
+        count = await export_forms(session, path, file_format)
+        if not count:
+            await message.answer("<u><b>Anketalar yo'q!</b></u>")
+            return
+        await message.answer_document(FSInputFile(path), caption=f"<b>Anketalar soni:</b> {count}")
+
+
+SEARCH_PAGE_SIZE = 5
+
+
+@admin_router.message(commands="search")
+async def search_applicants(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    """  Search applicants by name, address, university or company: /search <text>  """
+    if not command.args:
+        await message.answer("Qidiruv so'zini buyruqdan keyin yozing:\n"
+                             "/search <i>ism, manzil, o'quv yurti yoki korxona</i>")
+        return
+    forms, has_next = await search_forms(session, command.args, limit=SEARCH_PAGE_SIZE)
+    if not forms:
+        await message.answer("<u><b>Hech narsa topilmadi!</b></u>")
+        return
+    await state.update_data(search_query=command.args)
+    await message.answer(f"<b>Qidiruv natijalari:</b> {escape(command.args)}",
+                         reply_markup=make_search_keyboard(forms, 0, has_next))
+
+
+@admin_router.callback_query(AdminFilter(),
+                             MainCallbackFactory.filter((F.category == "search") & F.action.in_({"next", "previous"})))
+async def search_applicants_page(call: CallbackQuery, state: FSMContext, session: AsyncSession,
+                                 callback_data: MainCallbackFactory):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    search_query = (await state.get_data()).get("search_query")
+    if not search_query:
+        return
+    offset = int(callback_data.data)
+    if callback_data.action == "previous":
+        offset = max(offset - SEARCH_PAGE_SIZE, 0)
+    forms, has_next = await search_forms(session, search_query, limit=SEARCH_PAGE_SIZE, offset=offset)
+    if forms:
+        await call.message.edit_reply_markup(reply_markup=make_search_keyboard(forms, offset, has_next))
+
+
+@admin_router.callback_query(AdminFilter(),
+                             MainCallbackFactory.filter((F.category == "search") & (F.action == "select")))
+async def show_found_applicant(call: CallbackQuery, session: AsyncSession, callback_data: MainCallbackFactory):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    form = await session.get(Forms, int(callback_data.data))
+    if not form:
+        return
+    await call.message.answer(f"<b>Ism va Familiya:</b> {escape(form.full_name)}\n"
+                              f"<b>Tug'ilgan sana:</b> {form.birth_date:%d.%m.%Y}\n"
+                              f"<b>Telefon raqam:</b> {escape(form.phonenum)}\n"
+                              f"<b>Yashash manzil:</b> {escape(form.address)}\n"
+                              f"<b>Anketa yuborilgan:</b> {form.registered_at:%d.%m.%Y}")
+
+
+FILTER_RESULTS_LIMIT = 10
+
+
+async def get_facet_value_titles(session: AsyncSession, facet: str, values) -> dict[str, str]:
+    """  Titles of the facet's values, departments and language levels are known only at runtime  """
+    if facet == "department":
+        return {str(department_id): title.capitalize() for department_id, title in await get_all_departments(session)}
+    if facet == "language_level":
+        return {value: f"{value}-daraja" for value in sorted(values, key=int)}
+    return FACET_VALUE_TITLES[facet]
+
+
+async def render_filters_text(session: AsyncSession, filters: dict, count: int) -> str:
+    text = "<b>Anketalar filtri</b>\n"
+    for facet, values in filters.items():
+        if values:
+            titles = await get_facet_value_titles(session, facet, values)
+            text += f"<b>{FACET_TITLES[facet]}:</b> {', '.join(escape(titles.get(value, value)) for value in values)}\n"
+    return text + f"<b>Anketalar soni:</b> {count}"
+
+
+@admin_router.message(commands="filter")
+async def filter_applicants(message: Message, state: FSMContext, session: AsyncSession):
+    """  Filter applicants by facets, counts are updated on every change of filters  """
+    filters = (await state.get_data()).get("facet_filters", {})
+    count = await count_filtered_forms(session, filters)
+    await message.answer(await render_filters_text(session, filters, count),
+                         reply_markup=make_facets_keyboard(filters, count))
+
+
+@admin_router.callback_query(AdminFilter(),
+                             MainCallbackFactory.filter((F.category == "facets") & F.action.in_({"open", "reset"})))
+async def open_facet(call: CallbackQuery, state: FSMContext, session: AsyncSession,
+                     callback_data: MainCallbackFactory):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    if callback_data.action == "reset":
+        filters = {}
+        await state.update_data(facet_filters=filters)
+    else:
+        filters = (await state.get_data()).get("facet_filters", {})
+    facet = callback_data.data
+    if facet not in FACET_TITLES:
+        count = await count_filtered_forms(session, filters)
+        await call.message.edit_text(await render_filters_text(session, filters, count),
+                                     reply_markup=make_facets_keyboard(filters, count))
+        return
+    await show_facet_values(call, session, facet, filters)
+
+
+async def show_facet_values(call: CallbackQuery, session: AsyncSession, facet: str, filters: dict):
+    counts, count = await get_facet_counts(session, facet, filters)
+    value_titles = await get_facet_value_titles(session, facet, counts)
+    await call.message.edit_text(await render_filters_text(session, filters, count),
+                                 reply_markup=make_facet_values_keyboard(facet, filters, counts, value_titles))
+
+
+@admin_router.callback_query(AdminFilter(),
+                             MainCallbackFactory.filter((F.category == "facets") & (F.action == "toggle")))
+async def toggle_facet_value(call: CallbackQuery, state: FSMContext, session: AsyncSession,
+                             callback_data: MainCallbackFactory):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    facet, _, value = str(callback_data.data).partition("=")
+    if facet not in FACET_TITLES:
+        return
+    filters = (await state.get_data()).get("facet_filters", {})
+    values = filters.setdefault(facet, [])
+    if value in values:
+        values.remove(value)
+    else:
+        values.append(value)
+    if not values:
+        del filters[facet]
+    await state.update_data(facet_filters=filters)
+    await show_facet_values(call, session, facet, filters)
+
+
+@admin_router.callback_query(AdminFilter(),
+                             MainCallbackFactory.filter((F.category == "facets") & (F.action == "show")))
+async def show_filtered_applicants(call: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    filters = (await state.get_data()).get("facet_filters", {})
+    forms = await get_filtered_forms(session, filters, limit=FILTER_RESULTS_LIMIT)
+    if not forms:
+        await call.message.answer("<u><b>Hech narsa topilmadi!</b></u>")
+        return
+    await call.message.answer(f"<b>Oxirgi {len(forms)} ta anketa:</b>",
+                              reply_markup=make_search_keyboard([(*form, None) for form in forms], 0, False))
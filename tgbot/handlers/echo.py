@@ -2,7 +2,7 @@ from aiogram import types, Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.markdown import hcode
 
-echo_router = Router()
+echo_router = Router(name="echo")
 
 
 @echo_router.message(F.text, state=None)
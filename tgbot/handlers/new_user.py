@@ -1,24 +1,28 @@
 import logging
 from contextlib import suppress
+from datetime import datetime
+from typing import NamedTuple
 
 from aiogram import Router, Bot, F
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, ContentType
+from aiogram.fsm.state import State
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, ContentType, InlineKeyboardMarkup
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from tgbot.keyboards.inline import (home_keyboard, menu_control_keyboard, raw_confirming_keyboard,
                                     make_departments_keyboard, fill_form_keyboard, living_conditions_keyboard,
                                     educations_keyboard, confirming_keyboard, make_confirming_keyboard,
-                                    marital_status_keyboard)
+                                    marital_status_keyboard, make_choice_keyboard)
 from tgbot.keyboards.reply import user_menu, admin_menu
-from tgbot.database.functions.users import add_user, get_department
-from tgbot.database.models.models import Users
+from tgbot.database.functions.users import add_user, get_department, get_departments_page
+from tgbot.database.functions.forms import add_form, make_form_rows
 from tgbot.misc.states import NewUserStates
 from tgbot.config import Config
 from tgbot.misc.cbdata import MainCallbackFactory
+from tgbot.services.form_message import edit_form_message, render_form_message, FORM_CHOICES
 
-new_user_router = Router()
+new_user_router = Router(name="new_user")
 
 
 @new_user_router.callback_query(text_contains="home", state=NewUserStates)
@@ -29,9 +33,8 @@ async def cancel_form(call: CallbackQuery, state: FSMContext, bot: Bot, config:
     admin_ids = config.tg_bot.admin_ids
     current_state = await state.get_state()
     state_data = await state.get_data()
-    if current_state != "NewUserStates:q1_name" and current_state != "NewUserStates:ready_form":
-        await bot.delete_message(call.message.chat.id, state_data["question_message_id"])
-
+    if current_state == NewUserStates.confirming_department.state:
+        await bot.delete_message(call.message.chat.id, state_data["department_message_id"])
     await bot.delete_message(call.message.chat.id, state_data["form_message_id"])
     await bot.delete_message(call.message.chat.id, state_data["anketa_text_message_id"])
     await call.message.answer("<b>Ro'yhatdan o'tish bekor qilindi!</b>",
@@ -43,11 +46,9 @@ async def cancel_form(call: CallbackQuery, state: FSMContext, bot: Bot, config:
 async def user_start(message: Message, state: FSMContext, session: AsyncSession):
     """  Great the user  """
     await state.clear()
-    # Checking for user in database, if not exists adding to database
-    user = await session.get(Users, message.from_user.id)
-    if not user:
-        await add_user(session=session, telegram_id=message.from_user.id, username=message.from_user.username,
-                       telegram_name=message.from_user.full_name)
+    # Adding the user to database or refreshing his names
+    await add_user(session=session, telegram_id=message.from_user.id, username=message.from_user.username,
+                   telegram_name=message.from_user.full_name)
     await message.answer(
         f"<b>Assalamu Alaykum</b> {message.from_user.full_name}<b>!</b>\n"
         f"\"Company Name\" jamoasining hodimlarni boshqarish botiga xush kelibsiz!",
@@ -69,7 +70,7 @@ async def ask_q1(message: Message, state: FSMContext):
     form_message = await message.answer("<b>Ism va familiyangizni to'liq kiriting.</b>\n(Ahmadjon Ahmedov)",
                                         reply_markup=home_keyboard)
     await state.update_data(form_message_id=form_message.message_id,
-                            anketa_text_message_id=anketa_text_message.message_id)
+                            anketa_text_message_id=anketa_text_message.message_id, form={})
     await state.set_state(NewUserStates.q1_name)
 
 
@@ -77,14 +78,13 @@ async def ask_q1(message: Message, state: FSMContext):
 async def ask_q2(message: Message, state: FSMContext, bot: Bot):
     """  Ask the user's birthday  """
     await message.delete()
-    full_name = message.text
-    form_text = f"<b>Ism va Familiya:</b> {full_name}\n"
     state_data = await state.get_data()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id,
-                                message_id=state_data["form_message_id"])
-    question_message = await message.answer("<b>Tug'ulgan sanangizni kiriting.</b>\n(24.03.1998)",
-                                            reply_markup=menu_control_keyboard)
-    await state.update_data(full_name=full_name, form_text=form_text, question_message_id=question_message.message_id)
+    form = state_data["form"]
+    form["full_name"] = message.text
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Tug'ulgan sanangizni kiriting.</b>\n(24.03.1998)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q2_birth_date)
 
 
@@ -95,12 +95,22 @@ async def ask_q3(message: Message, state: FSMContext, bot: Bot):
     """  Ask the user for phone number  """
     await message.delete()
     state_data = await state.get_data()
-    text = state_data["form_text"] + f"<b>Tug'ilgan sana:</b> {message.text}\n"
-    await bot.edit_message_text(text=text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(
-        text="<b>Siz bilan bog'lanishimiz mumkin bo'lgan telefon raqamni kiriting.</b>\n(+998333360006)",
-        chat_id=message.chat.id, message_id=state_data["question_message_id"], reply_markup=menu_control_keyboard)
-    await state.update_data(birthday=message.text, form_text=text)
+    form = state_data["form"]
+    try:  # The regexp doesn't know lengths of months, e.g. 31.02.1998
+        birthday = datetime.strptime(message.text.strip().rstrip(".").replace("-", "."), "%d.%m.%Y")
+    except ValueError:
+        form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Tug'ulgan sanangizni kiriting.</b>\n(24.03.1998)\n\n"
+                                            "<i>Bunday sana mavjud emas!</i>",
+                                            reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+        await state.update_data(form_hash=form_hash)
+        return
+    form["birthday"] = birthday.strftime("%d.%m.%Y")
+    form_hash = await edit_form_message(
+        bot, message.chat.id, state_data["form_message_id"], form,
+        "<b>Siz bilan bog'lanishimiz mumkin bo'lgan telefon raqamni kiriting.</b>\n(+998333360006)",
+        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q3_phonenum)
 
 
@@ -109,20 +119,24 @@ async def ask_q3(message: Message, state: FSMContext, bot: Bot):
 async def confirm_q3(message: Message, state: FSMContext, bot: Bot):
     """  Ask user to confirm that the phone number was correct  """
     await message.delete()
-    phonenum = message.text
+    phonenum = message.contact.phone_number if message.contact else message.text
     state_data = await state.get_data()
-    await bot.edit_message_text(text=f"<b>Raqamni to'g'ri terdingizmi?</b>\n{phonenum}",
-                                chat_id=message.chat.id, message_id=state_data["question_message_id"],
-                                reply_markup=raw_confirming_keyboard)
-    await state.update_data(phonenum=phonenum)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], state_data["form"],
+                                        f"<b>Raqamni to'g'ri terdingizmi?</b>\n{phonenum}",
+                                        reply_markup=raw_confirming_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(phonenum=phonenum, form_hash=form_hash)
 
 
 @new_user_router.callback_query(text_contains="no", state=NewUserStates.q3_phonenum)
-async def callback_no(call: CallbackQuery):
+async def callback_no(call: CallbackQuery, state: FSMContext, bot: Bot):
     """  Ask again user's phone number if previous was incorrect  """
     await call.answer(cache_time=1)  # Simple anti-flood
-    await call.message.edit_text(text="<b>Siz bilan bog'lanishimiz mumkin bo'lgan telefon raqamni kiriting.</b>\n"
-                                      "(+998333360006)", reply_markup=menu_control_keyboard)
+    state_data = await state.get_data()
+    form_hash = await edit_form_message(
+        bot, call.message.chat.id, state_data["form_message_id"], state_data["form"],
+        "<b>Siz bilan bog'lanishimiz mumkin bo'lgan telefon raqamni kiriting.</b>\n(+998333360006)",
+        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form_hash=form_hash)
 
 
 @new_user_router.callback_query(text_contains="yes", state=NewUserStates.q3_phonenum)
@@ -130,44 +144,40 @@ async def ask_q4(call: CallbackQuery, state: FSMContext, bot: Bot, session: Asyn
     """  Ask user for direction of department  """
     await call.answer(cache_time=1)  # Simple anti-flood
     state_data = await state.get_data()
-    form_text = state_data["form_text"] + f"<b>Telefon raqam:</b> {state_data['phonenum']}\n"
-    keyboard_data = await make_departments_keyboard(session)
-    if not keyboard_data:
+    form = state_data["form"]
+    form["phonenum"] = state_data["phonenum"]
+    keyboard = make_departments_keyboard(await get_departments_page(session, limit=8))
+    if not keyboard:
         await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["form_message_id"])
-        await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["question_message_id"])
         await call.message.answer(text="<u><b>Xozircha ishga olish uchun mavjud bo'limlar yo'q!</b></u>",
                                   reply_markup=user_menu)
         return
-    await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                message_id=state_data["form_message_id"])
-    await call.message.edit_text("<b>Ishlamoqchi bo'lgan sohangizga mos bo'limni tanlang:</b>",
-                                 reply_markup=keyboard_data[0])
-    await state.update_data(form_text=form_text, first_button_id=keyboard_data[1], last_button_id=keyboard_data[2])
+    form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Ishlamoqchi bo'lgan sohangizga mos bo'limni tanlang:</b>",
+                                        reply_markup=keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q4_department)
 
 
 # Show next list of departments when user taps to next button
 @new_user_router.callback_query(MainCallbackFactory.filter(F.category == "departments" and F.action == "next"),
                                 state=NewUserStates.q4_department)
-async def next_departments_list(call: CallbackQuery, state: FSMContext, session: AsyncSession):
+async def next_departments_list(call: CallbackQuery, session: AsyncSession, callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)  # Simple anti-flood
-    state_data = await state.get_data()
-    keyboard_data = await make_departments_keyboard(session, start=state_data["last_button_id"] + 1)
-    await call.message.edit_text("<b>Ishlamoqchi bo'lgan sohangizga mos bo'limni tanlang:</b>",
-                                 reply_markup=keyboard_data[0])
-    await state.update_data(first_button_id=keyboard_data[1], last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=8, after=int(callback_data.data))
+    if page.departments:
+        await call.message.edit_reply_markup(reply_markup=make_departments_keyboard(page))
 
 
 # Show previous list of departments when user taps to previous button
 @new_user_router.callback_query(MainCallbackFactory.filter(F.category == "departments" and F.action == "previous"),
                                 state=NewUserStates.q4_department)
-async def previous_departments_list(call: CallbackQuery, state: FSMContext, session: AsyncSession):
+async def previous_departments_list(call: CallbackQuery, session: AsyncSession,
+                                    callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)  # Simple anti-flood
-    state_data = await state.get_data()
-    keyboard_data = await make_departments_keyboard(session, end=state_data["first_button_id"] - 1)
-    await call.message.edit_text("<b>Ishlamoqchi bo'lgan sohangizga mos bo'limni tanlang:</b>",
-                                 reply_markup=keyboard_data[0])
-    await state.update_data(first_button_id=keyboard_data[1], last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=8, before=int(callback_data.data))
+    if page.departments:
+        await call.message.edit_reply_markup(reply_markup=make_departments_keyboard(page))
 
 
 @new_user_router.callback_query(MainCallbackFactory.filter(F.category == "departments" and F.action == "select"),
@@ -178,17 +188,20 @@ async def show_department_requirements(call: CallbackQuery, bot: Bot, state: FSM
     selected_department = await get_department(session, department_id=callback_data.data)
     state_data = await state.get_data()
 
-    await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["question_message_id"])
+    # The form message is sent again below the department's photo
+    await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["form_message_id"])
     department_message = await call.message.answer_photo(
         photo=selected_department[2],
         caption=f"<b>{selected_department[0].capitalize()} bo'limi</b>\n{selected_department[1]}"
     )
-    question_message = await call.message.answer(
-        "<b>Siz tanlagan bo'lim hodimlari yuqorida ko'rsatilgan talablarga javob berishi kerak.</b>",
+    form_message = await call.message.answer(
+        render_form_message(state_data["form"], "<b>Siz tanlagan bo'lim hodimlari yuqorida ko'rsatilgan "
+                                                "talablarga javob berishi kerak.</b>"),
         reply_markup=fill_form_keyboard
     )
     await state.update_data(department_message_id=department_message.message_id, department=selected_department[0],
-                            question_message_id=question_message.message_id, department_id=callback_data.data)
+                            form_message_id=form_message.message_id, department_id=callback_data.data,
+                            form_hash=None)
     await state.set_state(NewUserStates.confirming_department)
 
 
@@ -196,12 +209,14 @@ async def show_department_requirements(call: CallbackQuery, bot: Bot, state: FSM
 async def ask_q5(call: CallbackQuery, bot: Bot, state: FSMContext):
     await call.answer(cache_time=1)  # Simple anti-flood
     state_data = await state.get_data()
-    form_text = state_data["form_text"] + f"<b>Bo'lim:</b> {state_data['department'].capitalize()}\n"
+    form = state_data["form"]
+    form["department"] = state_data["department"].capitalize()
     await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["department_message_id"])
-    await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id, message_id=state_data["form_message_id"])
-    await call.message.edit_text("<b>Doimiy yashash manzilingizni kiriting.</b>\n(Alisher Navoiy ko'chasi 150 uy)",
-                                 reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text)
+    form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Doimiy yashash manzilingizni kiriting.</b>\n"
+                                        "(Alisher Navoiy ko'chasi 150 uy)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q5_address)
 
 
@@ -209,11 +224,12 @@ async def ask_q5(call: CallbackQuery, bot: Bot, state: FSMContext):
 async def ask_q6(message: Message, bot: Bot, state: FSMContext):
     await message.delete()
     state_data = await state.get_data()
-    form_text = state_data["form_text"] + f"<b>Yashash manzil:</b> {message.text}\n"
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Yashash sharoitingiz:</b>", chat_id=message.chat.id,
-                                message_id=state_data["question_message_id"], reply_markup=living_conditions_keyboard)
-    await state.update_data(form_text=form_text, address=message.text)
+    form = state_data["form"]
+    form["address"] = message.text
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Yashash sharoitingiz:</b>", reply_markup=living_conditions_keyboard,
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q6_living_conditions)
 
 
@@ -222,11 +238,12 @@ async def ask_q6(message: Message, bot: Bot, state: FSMContext):
 async def ask_q7(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)
     state_data = await state.get_data()
-    living_condition_uz = "Dom" if callback_data.data == "flat" else "Hovli"
-    form_text = state_data["form_text"] + f"<b>Yashsh sharoit:</b> {living_condition_uz}\n"
-    await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id, message_id=state_data["form_message_id"])
-    await call.message.edit_text("<b>Ma'lumotingiz:</b>", reply_markup=educations_keyboard)
-    await state.update_data(living_conditions=callback_data.data, form_text=form_text)
+    form = state_data["form"]
+    form["living_conditions"] = callback_data.data
+    form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Ma'lumotingiz:</b>", reply_markup=educations_keyboard,
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q7_education)
 
 
@@ -235,19 +252,13 @@ async def ask_q7(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data
 async def ask_q8(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)
     state_data = await state.get_data()
-    education_uz = "O'rta"
-    if callback_data.data == "secondary_special":
-        education_uz = "O'rta maxsus"
-    elif callback_data.data == "bachelor":
-        education_uz = "Oliy | Bakalavr"
-    elif callback_data.data == "master":
-        education_uz = "Oliy | Magistr"
-    form_text = state_data["form_text"] + f"<b>Ma'lumot:</b> {education_uz}\n"
-    keyboard = await make_confirming_keyboard(category="universities")
-    await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id, message_id=state_data["form_message_id"])
-    await call.message.edit_text(text="<b>Biron bir o'quv yurtini tamomlaganmisiz?</b>\n",
-                                 reply_markup=keyboard)
-    await state.update_data(education=callback_data.data, form_text=form_text)
+    form = state_data["form"]
+    form["education"] = callback_data.data
+    form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Biron bir o'quv yurtini tamomlaganmisiz?</b>\n",
+                                        reply_markup=make_confirming_keyboard(category="universities"),
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q8_university)
 
 
@@ -256,76 +267,61 @@ async def ask_q8(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data
 async def ask_university_name_or_q9(call: CallbackQuery, bot: Bot, state: FSMContext,
                                     callback_data: MainCallbackFactory):
     state_data = await state.get_data()
+    form = state_data["form"]
+    universities = form.setdefault("universities", [])
     if callback_data.data == "add":
-        form_text = state_data["form_text"] + f"<b>O'quv yurti: </b>"
-        await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                    message_id=state_data["form_message_id"])
-        question_message = await call.message.edit_text(
-            "<b>Qaysi o'quv yurtini tamomlagansiz?</b>\n(Qo'qon Universiteti)",
-            reply_markup=menu_control_keyboard)
+        universities.append({})
+        form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Qaysi o'quv yurtini tamomlagansiz?</b>\n(Qo'qon Universiteti)",
+                                            reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
         await state.set_state(NewUserStates.university_name)
-        await state.update_data(question_message_id=question_message.message_id, form_text=form_text, universities=[])
 
     else:
-        try:
-            universities = state_data["universities"]
-        except KeyError:
-            universities = None
-        if not universities:  # If there isn't added universities
-            form_text = state_data["form_text"] + "<b>O'quv yurti: </b>\U00002796\n"  # Emoji 'heavy_minus_sign'
-            await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                        message_id=state_data["form_message_id"])
-            await state.update_data(universities=[], form_text=form_text)
-
-        keyboard = await make_confirming_keyboard(category="worked_companies")
-        await call.message.edit_text("<b>Avval biron bir korxona yoki tashkilotda ishlaganmisiz?</b>",
-                                     reply_markup=keyboard)
+        form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Avval biron bir korxona yoki tashkilotda ishlaganmisiz?</b>",
+                                            reply_markup=make_confirming_keyboard(category="worked_companies"),
+                                            last_hash=state_data.get("form_hash"))
         await state.set_state(NewUserStates.q9_worked_companies)
+    await state.update_data(form=form, form_hash=form_hash)
 
 
 @new_user_router.message(F.text, state=NewUserStates.university_name)
 async def ask_university_direction(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    university_name = message.text.strip()
-    form_text = state_data["form_text"] + f"\n    <b>Nomi:</b> {university_name}\n"
+    form = state_data["form"]
+    form["universities"][-1]["name"] = message.text.strip()
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Qaysi yo'nalishida o'qigansiz?</b>\n(Moliya)", chat_id=message.chat.id,
-                                message_id=state_data["question_message_id"], reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, university_name=university_name)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Qaysi yo'nalishida o'qigansiz?</b>\n(Moliya)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.university_direction)
 
 
 @new_user_router.message(F.text, state=NewUserStates.university_direction)
 async def ask_university_finished_year(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    university_direction = message.text.strip()
-    form_text = state_data["form_text"] + f"    <b>Yo'nalishi:</b> {university_direction}\n"
+    form = state_data["form"]
+    form["universities"][-1]["direction"] = message.text.strip()
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text("<b>Qachon tamomlagansiz?</b>\n(2018)", chat_id=message.chat.id,
-                                message_id=state_data["question_message_id"], reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, university_direction=university_direction)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Qachon tamomlagansiz?</b>\n(2018)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.university_finished_year)
 
 
-@new_user_router.message(F.text.regexp(r"^[1, 2][9, 0]\d\d$"), state=NewUserStates.university_finished_year)
+@new_user_router.message(F.text.regexp(r"^[12][90]\d\d$"), state=NewUserStates.university_finished_year)
 async def ask_again_q8(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    university_finished_year = message.text
-    university_data = {"name": state_data["university_name"], "direction": state_data["university_direction"],
-                       "finished_year": university_finished_year}
-    universities = state_data["universities"]
-    universities.append(university_data)
-    logging.info(universities)
-    form_text = state_data["form_text"] + f"    <b>Tamomlagan yili:</b> {university_finished_year}\n"
-    keyboard = await make_confirming_keyboard(category="universities")
+    form = state_data["form"]
+    form["universities"][-1]["finished_year"] = message.text
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Yana biron bir o'quv yurtini tamomlaganmisiz?</b>\n",
-                                chat_id=message.chat.id, message_id=state_data["question_message_id"],
-                                reply_markup=keyboard)
-    await state.update_data(form_text=form_text, universities=universities)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Yana biron bir o'quv yurtini tamomlaganmisiz?</b>\n",
+                                        reply_markup=make_confirming_keyboard(category="universities"),
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q8_university)
 
 
@@ -333,91 +329,75 @@ async def ask_again_q8(message: Message, bot: Bot, state: FSMContext):
                                 state=NewUserStates.q9_worked_companies)
 async def ask_company_name_or_q10(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data: MainCallbackFactory):
     state_data = await state.get_data()
+    form = state_data["form"]
+    companies = form.setdefault("companies", [])
     if callback_data.data == "add":
-        form_text = state_data["form_text"] + f"<b>Sobiq korxona: </b>"
-        await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                    message_id=state_data["form_message_id"])
-        question_message = await call.message.edit_text(
-            "<b>Ishlagan korxonangizning nomi nima?</b>\n(AyuBDev)",
-            reply_markup=menu_control_keyboard)
+        companies.append({})
+        form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Ishlagan korxonangizning nomi nima?</b>\n(AyuBDev)",
+                                            reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
         await state.set_state(NewUserStates.company_name)
-        await state.update_data(question_message_id=question_message.message_id, form_text=form_text, companies=[])
 
     else:
-        try:
-            companies = state_data["companies"]
-        except KeyError:
-            companies = None
-        if not companies:  # If there isn't added universities
-            form_text = state_data["form_text"] + "<b>Sobiq korxona: </b>\U00002796\n"  # Emoji 'heavy_minus_sign'
-            await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                        message_id=state_data["form_message_id"])
-            await state.update_data(companies=[], form_text=form_text)
-
-        keyboard = await make_confirming_keyboard(category="trips")
-        await call.message.edit_text("<b>Chet elga sayohat qilganmisiz?</b>",
-                                     reply_markup=keyboard)
+        form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Chet elga sayohat qilganmisiz?</b>",
+                                            reply_markup=make_confirming_keyboard(category="trips"),
+                                            last_hash=state_data.get("form_hash"))
         await state.set_state(NewUserStates.q10_trip)
+    await state.update_data(form=form, form_hash=form_hash)
 
 
 @new_user_router.message(F.text, state=NewUserStates.company_name)
 async def ask_company_position(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    company_name = message.text.strip()
-    form_text = state_data["form_text"] + f"\n    <b>Nomi:</b> {company_name}\n"
+    form = state_data["form"]
+    form["companies"][-1]["name"] = message.text.strip()
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Qaysi lavozimda ishlagansiz?</b>\n(Buxgalter)", chat_id=message.chat.id,
-                                message_id=state_data["question_message_id"], reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, company_name=company_name)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Qaysi lavozimda ishlagansiz?</b>\n(Buxgalter)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.company_position)
 
 
 @new_user_router.message(F.text, state=NewUserStates.company_position)
 async def ask_company_working_period(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    company_position = message.text.strip()
-    form_text = state_data["form_text"] + f"    <b>Lavozimi:</b> {company_position}\n"
+    form = state_data["form"]
+    form["companies"][-1]["position"] = message.text.strip()
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text("<b>Qachon ishga kirgansiz va qachon ishdan ketgansiz?</b>\n(2018 - 2021)",
-                                chat_id=message.chat.id, message_id=state_data["question_message_id"],
-                                reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, company_position=company_position)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Qachon ishga kirgansiz va qachon ishdan ketgansiz?</b>\n(2018 - 2021)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.company_working_period)
 
 
-@new_user_router.message(F.text.regexp(r"^[1, 2][9, 0]\d\d - [1, 2][9, 0]\d\d$"),
+@new_user_router.message(F.text.regexp(r"^[12][90]\d\d - [12][90]\d\d$"),
                          state=NewUserStates.company_working_period)
 async def ask_company_leaving_reason(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    company_working_period = message.text
-    form_text = state_data["form_text"] + f"    <b>Ishlash davri:</b> {message.text}\n"
+    form = state_data["form"]
+    form["companies"][-1]["working_period"] = message.text
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Nima sababdan ishdan ketgansiz?</b>",
-                                chat_id=message.chat.id, message_id=state_data["question_message_id"],
-                                reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, company_working_period=company_working_period)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Nima sababdan ishdan ketgansiz?</b>",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.company_leaving_reason)
 
 
 @new_user_router.message(F.text, state=NewUserStates.company_leaving_reason)
 async def ask_again_q9(message: Message, bot: Bot, state: FSMContext):
     state_data = await state.get_data()
-    company_leaving_reason = message.text
-    company_data = {"name": state_data["company_name"], "position": state_data["company_position"],
-                    "working_period": state_data["company_working_period"], "leaving_reason": company_leaving_reason}
-    companies = state_data["companies"]
-    companies.append(company_data)
-    form_text = state_data["form_text"] + f"    <b>Ketish sababi:</b> {company_leaving_reason}\n"
-    keyboard = await make_confirming_keyboard(category="worked_companies")
+    form = state_data["form"]
+    form["companies"][-1]["leaving_reason"] = message.text
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Yana biron bir korxona yoki tashkilotda ishlaganmisiz?</b>",
-                                chat_id=message.chat.id, message_id=state_data["question_message_id"],
-                                reply_markup=keyboard)
-    await state.update_data(form_text=form_text, companies=companies)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Yana biron bir korxona yoki tashkilotda ishlaganmisiz?</b>",
+                                        reply_markup=make_confirming_keyboard(category="worked_companies"),
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.q9_worked_companies)
 
 
@@ -425,41 +405,181 @@ async def ask_again_q9(message: Message, bot: Bot, state: FSMContext):
                                 state=NewUserStates.q10_trip)
 async def ask_trip_country_or_q11(call: CallbackQuery, bot: Bot, state: FSMContext, callback_data: MainCallbackFactory):
     state_data = await state.get_data()
+    form = state_data["form"]
+    trips = form.setdefault("trips", [])
     if callback_data.data == "add":
-        form_text = state_data["form_text"] + f"<b>Sayohat: </b>"
-        await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                    message_id=state_data["form_message_id"])
-        question_message = await call.message.edit_text(
-            "<b>Qaysi davlatga sayohat qilgansiz?</b>\n(Germaniya)",
-            reply_markup=menu_control_keyboard)
-        await state.set_state(NewUserStates.company_name)
-        await state.update_data(question_message_id=question_message.message_id, form_text=form_text, trips=[])
+        trips.append({})
+        form_hash = await edit_form_message(bot, call.message.chat.id, state_data["form_message_id"], form,
+                                            "<b>Qaysi davlatga sayohat qilgansiz?</b>\n(Germaniya)",
+                                            reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+        await state.set_state(NewUserStates.trip_country)
 
     else:
-        try:
-            trips = state_data["trips"]
-        except KeyError:
-            trips = None
-        if not trips:  # If there isn't added universities
-            form_text = state_data["form_text"] + "<b>Sayohat: </b>\U00002796\n"  # Emoji 'heavy_minus_sign'
-            await bot.edit_message_text(text=form_text, chat_id=call.message.chat.id,
-                                        message_id=state_data["form_message_id"])
-            await state.update_data(companies=[], form_text=form_text)
-
-        await call.message.edit_text("<b>Oilaviy ahvolingiz:</b>",
-                                     reply_markup=marital_status_keyboard)
-        await state.set_state(NewUserStates.q10_trip)
+        await ask_question(bot, call.message.chat.id, state, state_data, form, index=0)
+        return
+    await state.update_data(form=form, form_hash=form_hash)
 
 
 @new_user_router.message(F.text, state=NewUserStates.trip_country)
 async def ask_trip_country(message: Message, bot: Bot, state: FSMContext):
     """  Ask where the user has traveled  """
     state_data = await state.get_data()
-    trip_country = message.text.strip()
-    form_text = state_data["form_text"] + f"\n    <b>Davlat:</b> {trip_country}\n"
+    form = state_data["form"]
+    form["trips"][-1]["country"] = message.text.strip()
     await message.delete()
-    await bot.edit_message_text(text=form_text, chat_id=message.chat.id, message_id=state_data["form_message_id"])
-    await bot.edit_message_text(text="<b>Nima sababdan chet elga chiqqansiz?</b>", chat_id=message.chat.id,
-                                message_id=state_data["question_message_id"], reply_markup=menu_control_keyboard)
-    await state.update_data(form_text=form_text, trip_country=trip_country)
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Nima sababdan chet elga chiqqansiz?</b>",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
     await state.set_state(NewUserStates.trip_reason)
+
+
+@new_user_router.message(F.text, state=NewUserStates.trip_reason)
+async def ask_trip_period(message: Message, bot: Bot, state: FSMContext):
+    state_data = await state.get_data()
+    form = state_data["form"]
+    form["trips"][-1]["reason"] = message.text.strip()
+    await message.delete()
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Qachon sayohat qilgansiz?</b>\n(2019)",
+                                        reply_markup=menu_control_keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
+    await state.set_state(NewUserStates.trip_period)
+
+
+@new_user_router.message(F.text.regexp(r"^[12][90]\d\d$"), state=NewUserStates.trip_period)
+async def ask_again_q10(message: Message, bot: Bot, state: FSMContext):
+    state_data = await state.get_data()
+    form = state_data["form"]
+    form["trips"][-1]["period"] = message.text
+    await message.delete()
+    form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                        "<b>Yana chet elga sayohat qilganmisiz?</b>",
+                                        reply_markup=make_confirming_keyboard(category="trips"),
+                                        last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
+    await state.set_state(NewUserStates.q10_trip)
+
+
+class Question(NamedTuple):
+    state: State
+    field: str  # Key of the answer in the form, see FORM_FIELDS
+    text: str
+    keyboard: InlineKeyboardMarkup = menu_control_keyboard
+    max_length: int = 255  # Length of the column, answers by buttons are codes of FORM_CHOICES
+
+    @property
+    def is_choice(self) -> bool:
+        return self.field in FORM_CHOICES
+
+
+def choice_question(state: State, field: str, text: str) -> Question:
+    return Question(state, field, text, make_choice_keyboard(field, tuple(FORM_CHOICES[field].items())))
+
+
+# Questions after trips are asked one by one in this order, the photo is asked last
+QUESTIONS = (
+    Question(NewUserStates.q8_marital_status, "marital_status", "<b>Oilaviy ahvolingiz:</b>",
+             marital_status_keyboard),
+    choice_question(NewUserStates.business_trip, "business_trip", "<b>Xizmat safarlariga borishga rozimisiz?</b>"),
+    choice_question(NewUserStates.q10_military, "military_service", "<b>Harbiy xizmatni o'taganmisiz?</b>"),
+    Question(NewUserStates.q11_criminal, "criminal_record",
+             "<b>Sudlanganmisiz? Sudlangan bo'lsangiz, sababini yozing.</b>\n(Yo'q)"),
+    Question(NewUserStates.q12_driver_license, "driver_license",
+             "<b>Haydovchilik guvohnomangiz toifalari:</b>\n(B, C yoki Yo'q)", max_length=10),
+    Question(NewUserStates.q13_car, "personal_car", "<b>Shaxsiy avtomobilingiz:</b>\n(Nexia 3 yoki Yo'q)",
+             max_length=64),
+    choice_question(NewUserStates.q14_ru_lang, "russian", "<b>Rus tilini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q15_eng_lang, "english", "<b>Ingliz tilini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q16_chi_lang, "chinese", "<b>Xitoy tilini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q18_word_app, "word", "<b>Word dasturini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q19_excel_app, "excel", "<b>Excel dasturini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q20_1c_app, "1c", "<b>1C dasturini bilish darajangiz:</b>"),
+    choice_question(NewUserStates.q22_origin, "origin", "<b>Biz haqimizda qayerdan eshitdingiz?</b>"),
+    Question(NewUserStates.salary_last_job, "salary_last_job",
+             "<b>Oxirgi ish joyingizdagi oylik maoshingiz:</b>\n(3 000 000 so'm)"),
+    choice_question(NewUserStates.overwork_agreement, "overwork_agreement",
+                    "<b>Qo'shimcha ish soatlarida ishlashga rozimisiz?</b>"),
+    choice_question(NewUserStates.force_majeure_salary_agreement, "force_majeure_salary_agreement",
+                    "<b>Fors-major holatlarda maosh kechikishiga rozimisiz?</b>"),
+    choice_question(NewUserStates.working_style, "working_style", "<b>Qanday ishlashni afzal ko'rasiz?</b>"),
+    Question(NewUserStates.health, "health", "<b>Sog'lig'ingiz haqida yozing.</b>\n(Sog'lom)"),
+)
+QUESTION_INDEXES = {question.state.state: index for index, question in enumerate(QUESTIONS)}
+
+
+async def ask_question(bot: Bot, chat_id: int, state: FSMContext, state_data: dict, form: dict, index: int):
+    """  Ask the question of QUESTIONS by its index, or the photo after the last one  """
+    if index < len(QUESTIONS):
+        question = QUESTIONS[index]
+        text, keyboard, next_state = question.text, question.keyboard, question.state
+    else:
+        text, keyboard, next_state = "<b>3x4 o'lchamdagi rasmingizni yuboring.</b>", home_keyboard, \
+            NewUserStates.q23_photo
+    form_hash = await edit_form_message(bot, chat_id, state_data["form_message_id"], form, text,
+                                        reply_markup=keyboard, last_hash=state_data.get("form_hash"))
+    await state.update_data(form=form, form_hash=form_hash)
+    await state.set_state(next_state)
+
+
+@new_user_router.callback_query(MainCallbackFactory.filter(),
+                                state=[question.state for question in QUESTIONS if question.is_choice])
+async def answer_choice_question(call: CallbackQuery, bot: Bot, state: FSMContext,
+                                 callback_data: MainCallbackFactory):
+    await call.answer(cache_time=1)  # Simple anti-flood
+    index = QUESTION_INDEXES[await state.get_state()]
+    question, answer = QUESTIONS[index], str(callback_data.data)
+    if callback_data.category != question.field or answer not in FORM_CHOICES[question.field]:
+        return  # A button of the previous question
+    state_data = await state.get_data()
+    form = state_data["form"]
+    form[question.field] = answer
+    await ask_question(bot, call.message.chat.id, state, state_data, form, index + 1)
+
+
+@new_user_router.message(F.text, state=[question.state for question in QUESTIONS if not question.is_choice])
+async def answer_text_question(message: Message, bot: Bot, state: FSMContext):
+    await message.delete()
+    index = QUESTION_INDEXES[await state.get_state()]
+    question = QUESTIONS[index]
+    state_data = await state.get_data()
+    form = state_data["form"]
+    answer = message.text.strip()
+    if len(answer) > question.max_length:
+        form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                                            f"{question.text}\n\n<i>Javob {question.max_length} belgidan "
+                                            f"oshmasligi kerak!</i>",
+                                            reply_markup=question.keyboard, last_hash=state_data.get("form_hash"))
+        await state.update_data(form_hash=form_hash)
+        return
+    form[question.field] = answer
+    await ask_question(bot, message.chat.id, state, state_data, form, index + 1)
+
+
+@new_user_router.message(content_types=ContentType.PHOTO, state=NewUserStates.q23_photo)
+async def submit_form(message: Message, bot: Bot, state: FSMContext, session: AsyncSession, config: Config):
+    """  Save the completed form with all its answers in one transaction and finish form filling  """
+    await message.delete()
+    state_data = await state.get_data()
+    form = state_data["form"]
+    form["photo_id"] = message.photo[-1].file_id
+    try:
+        form_rows = make_form_rows(form)
+    except (ValueError, KeyError):
+        # Answers saved by an older version of the bot can't be converted, the form is filled again
+        logging.exception("Invalid answers of the form of %s", message.from_user.id)
+        form_hash = await edit_form_message(bot, message.chat.id, state_data["form_message_id"], {},
+                                            "<b>Anketada xatolik bor, iltimos qaytadan to'ldiring.</b>\n\n"
+                                            "<b>Ism va familiyangizni to'liq kiriting.</b>\n(Ahmadjon Ahmedov)",
+                                            reply_markup=home_keyboard, last_hash=state_data.get("form_hash"))
+        await state.update_data(form={}, form_hash=form_hash)
+        await state.set_state(NewUserStates.q1_name)
+        return
+    await add_form(session, message.from_user.id, department_ids=[int(state_data["department_id"])], **form_rows)
+    await edit_form_message(bot, message.chat.id, state_data["form_message_id"], form,
+                            "<b>Anketangiz qabul qilindi! Tez orada siz bilan bog'lanamiz.</b>",
+                            last_hash=state_data.get("form_hash"))
+    await bot.delete_message(message.chat.id, state_data["anketa_text_message_id"])
+    await message.answer("<b>Ro'yhatdan o'tish yakunlandi!</b>",
+                         reply_markup=admin_menu if message.from_user.id in config.tg_bot.admin_ids else user_menu)
+    await state.clear()
@@ -7,15 +7,22 @@ from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, ContentTy
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from tgbot.database.functions.users import get_all_departments, get_departments, get_department, add_department, \
-    delete_department
+from tgbot.database.functions.cache import DepartmentsPage
+from tgbot.database.functions.users import get_all_departments, get_departments_page, get_department, \
+    add_department, delete_department
 from tgbot.keyboards.inline import (cancel_keyboard, raw_confirming_keyboard,
                                     make_departments_id_keyboard, department_menu_keyboard)
 from tgbot.keyboards.reply import admin_menu
 from tgbot.misc.cbdata import MainCallbackFactory
 from tgbot.misc.states import DepartmentStates
 
-superuser_router = Router()
+superuser_router = Router(name="superuser")
+
+
+def make_departments_text(page: DepartmentsPage, text: str = "<b>Barcha mavjud bo'limlar:</b>\n") -> str:
+    for department_id, title in page.departments:
+        text += f"{department_id}. {title.capitalize()}\n"
+    return text
 
 
 # Add a new department to database
@@ -115,51 +122,42 @@ async def cancel_adding_department(call: CallbackQuery, state: FSMContext, bot:
 # Get all existing departments from database
 @superuser_router.message(commands=["get_departments"])
 async def show_departments(message: Message, state: FSMContext, session: AsyncSession):
-    existing_departments = await get_departments(session, limit=10)
+    page = await get_departments_page(session, limit=10)
     await message.answer("<b>Soha bo'limlari ro'yxati:</b>", reply_markup=ReplyKeyboardRemove())
-    if not existing_departments:
+    if not page.departments:
         await message.answer("<u><b>Mavjud bo'limlar yo'q!</b></u>")
         return
-    text = str()
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    keyboard_data = await make_departments_id_keyboard(session)
-    departments_message = await message.answer(text, reply_markup=keyboard_data[0])
-    await state.update_data(departments_message_id=departments_message.message_id, first_button_id=keyboard_data[1],
-                            last_button_id=keyboard_data[2])
+    departments_message = await message.answer(make_departments_text(page, text=str()),
+                                               reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(departments_message_id=departments_message.message_id,
+                            first_button_id=page.departments[0][0])
     await state.set_state(DepartmentStates.showing_departments_list)
 
 
 # Show next list of departments when user taps to next button
 @superuser_router.callback_query(MainCallbackFactory.filter(F.category == "departments" and F.action == "next"),
                                  state=DepartmentStates.showing_departments_list)
-async def next_departments_list(call: CallbackQuery, bot: Bot, state: FSMContext, session: AsyncSession):
+async def next_departments_list(call: CallbackQuery, state: FSMContext, session: AsyncSession,
+                                callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)  # Simple anti-flood
-    state_data = await state.get_data()
-    keyboard_data = await make_departments_id_keyboard(session, start=state_data["last_button_id"] + 1)
-    existing_departments = await get_departments(session, start=state_data["last_button_id"] + 1)
-    text = f"<b>Barcha mavjud bo'limlar:</b>\n"
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    await bot.edit_message_text(text, chat_id=call.message.chat.id,
-                                message_id=state_data["departments_message_id"], reply_markup=keyboard_data[0])
-    await state.update_data(first_button_id=keyboard_data[1], last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=10, after=int(callback_data.data))
+    if not page.departments:
+        return
+    await call.message.edit_text(make_departments_text(page), reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(first_button_id=page.departments[0][0])
 
 
 # Show previous list of departments when user taps to previous button
 @superuser_router.callback_query(MainCallbackFactory.filter(F.category == "departments" and F.action == "previous"),
                                  state=DepartmentStates.showing_departments_list)
-async def previous_departments_list(call: CallbackQuery, bot: Bot, state: FSMContext, session: AsyncSession):
+async def previous_departments_list(call: CallbackQuery, state: FSMContext, session: AsyncSession,
+                                    callback_data: MainCallbackFactory):
     await call.answer(cache_time=1)  # Simple anti-flood
-    state_data = await state.get_data()
-    keyboard_data = await make_departments_id_keyboard(session, end=state_data["first_button_id"] - 1)
-    existing_departments = await get_departments(session, end=state_data["first_button_id"] - 1)
-    text = f"<b>Barcha mavjud bo'limlar:</b>\n"
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    await bot.edit_message_text(text, chat_id=call.message.chat.id,
-                                message_id=state_data["departments_message_id"], reply_markup=keyboard_data[0])
-    await state.update_data(first_button_id=keyboard_data[1], last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=10, before=int(callback_data.data))
+    if not page.departments:
+        return
+    await call.message.edit_text(make_departments_text(page), reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(first_button_id=page.departments[0][0])
 
 
 # Open selected department and show additional data about it
@@ -201,14 +199,11 @@ async def cancel_deleting_department(call: CallbackQuery, bot: Bot, state: FSMCo
     await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["confirming_message_id"])
     await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["departments_message_id"])
     await state.clear()
-    existing_departments = await get_departments(session, limit=10, start=state_data["first_button_id"])
-    text = f"<b>Barcha mavjud bo'limlar:</b>\n"
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    keyboard_data = await make_departments_id_keyboard(session, start=state_data["first_button_id"])
-    departments_message = await call.message.answer(text, reply_markup=keyboard_data[0])
-    await state.update_data(departments_message_id=departments_message.message_id, first_button_id=keyboard_data[1],
-                            last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=10, after=state_data["first_button_id"] - 1)
+    departments_message = await call.message.answer(make_departments_text(page),
+                                                    reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(departments_message_id=departments_message.message_id,
+                            first_button_id=state_data["first_button_id"])
     await state.set_state(DepartmentStates.showing_departments_list)
 
 
@@ -223,13 +218,14 @@ async def complete_deleting_department(call: CallbackQuery, bot: Bot, state: FSM
     await call.message.answer(
         f"<u><b>\"{state_data['department_title'].capitalize()}\" bo'limi ma'lumotlar bazasidan o'chirildi!</b></u>")
     await state.clear()
-    existing_departments = await get_departments(session, limit=10)
-    text = f"<b>Barcha mavjud bo'limlar:</b>\n"
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    keyboard_data = await make_departments_id_keyboard(session)
-    departments_message = await call.message.answer(text, reply_markup=keyboard_data[0])
-    await state.update_data(departments_message_id=departments_message.message_id, last_button_id=keyboard_data[2])
+    page = await get_departments_page(session, limit=10)
+    if not page.departments:
+        await call.message.answer("<u><b>Mavjud bo'limlar yo'q!</b></u>", reply_markup=admin_menu)
+        return
+    departments_message = await call.message.answer(make_departments_text(page),
+                                                    reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(departments_message_id=departments_message.message_id,
+                            first_button_id=page.departments[0][0])
     await state.set_state(DepartmentStates.showing_departments_list)
 
 
@@ -239,15 +235,11 @@ async def complete_deleting_department(call: CallbackQuery, bot: Bot, state: FSM
 async def back_to_departments_list(call: CallbackQuery, bot: Bot, state: FSMContext, session: AsyncSession):
     await call.answer(cache_time=1)  # Simple anti-flood
     state_data = await state.get_data()
-    existing_departments = await get_departments(session, limit=10, start=state_data["first_button_id"])
-    text = f"<b>Barcha mavjud bo'limlar:</b>\n"
-    for department_id, title in existing_departments:
-        text += f"{department_id}. {title.capitalize()}\n"
-    keyboard_data = await make_departments_id_keyboard(session, start=state_data["first_button_id"])
+    page = await get_departments_page(session, limit=10, after=state_data["first_button_id"] - 1)
     await bot.delete_message(chat_id=call.message.chat.id, message_id=state_data["departments_message_id"])
-    departments_message = await call.message.answer(text, reply_markup=keyboard_data[0])
-    await state.update_data(departments_message_id=departments_message.message_id, first_button_id=keyboard_data[1],
-                            last_button_id=keyboard_data[2])
+    departments_message = await call.message.answer(make_departments_text(page),
+                                                    reply_markup=make_departments_id_keyboard(page))
+    await state.update_data(departments_message_id=departments_message.message_id)
     await state.set_state(DepartmentStates.showing_departments_list)
 
 
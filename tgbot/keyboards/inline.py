@@ -1,11 +1,11 @@
 import logging
+from functools import lru_cache
 from typing import Optional
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from tgbot.database.functions.users import get_all_departments, get_departments
+from tgbot.database.functions.cache import DepartmentsPage
 from tgbot.misc.cbdata import MainCallbackFactory
 
 home_keyboard = InlineKeyboardMarkup(
@@ -130,59 +130,88 @@ marital_status_keyboard = InlineKeyboardMarkup(
 )
 
 
-async def make_confirming_keyboard(category: str):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="\U00002795",  # Emoji 'heavy_plus_sign'
-                                  callback_data=MainCallbackFactory(category=category, data="add").pack())],
-            [
-                InlineKeyboardButton(text="\U00002B05",  # Emoji 'arrow_left'
-                                     callback_data=MainCallbackFactory(category=category, data="back").pack()),
-                InlineKeyboardButton(text="\U000027A1",  # Emoji 'arrow_right'
-                                     callback_data=MainCallbackFactory(category=category, data="next").pack()),
-            ],
-            [InlineKeyboardButton(text="\U0001F3E0",
-                                  callback_data=MainCallbackFactory(category=category, data="home").pack())]
-        ]
+Rows = tuple[tuple[InlineKeyboardButton, ...], ...]
+
+
+def rows_to_markup(rows: Rows) -> InlineKeyboardMarkup:
+    """  Keyboards are cached as rows, every call gets a new markup which it may change without touching the cache  """
+    return InlineKeyboardMarkup(inline_keyboard=[list(row) for row in rows])
+
+
+def builder_rows(builder: InlineKeyboardBuilder) -> Rows:
+    return tuple(tuple(row) for row in builder.export())
+
+
+@lru_cache(maxsize=None)
+def make_confirming_rows(category: str) -> Rows:
+    return (
+        (InlineKeyboardButton(text="\U00002795",  # Emoji 'heavy_plus_sign'
+                              callback_data=MainCallbackFactory(category=category, data="add").pack()),),
+        (
+            InlineKeyboardButton(text="\U00002B05",  # Emoji 'arrow_left'
+                                 callback_data=MainCallbackFactory(category=category, data="back").pack()),
+            InlineKeyboardButton(text="\U000027A1",  # Emoji 'arrow_right'
+                                 callback_data=MainCallbackFactory(category=category, data="next").pack()),
+        ),
+        (InlineKeyboardButton(text="\U0001F3E0",
+                              callback_data=MainCallbackFactory(category=category, data="home").pack()),)
     )
-    return keyboard
 
 
-async def make_departments_keyboard(session: AsyncSession, limit=8, start=1, end=None) -> Optional[
-    tuple[InlineKeyboardMarkup, int, int]
-]:
-    builder = InlineKeyboardBuilder()
-    all_departments = await get_all_departments(session)
-    try:
-        first_department_id = all_departments[0][0]
-        last_department_id = all_departments[-1][0]
-    except IndexError:
-        return
+def make_confirming_keyboard(category: str) -> InlineKeyboardMarkup:
+    return rows_to_markup(make_confirming_rows(category))
 
-    existing_departments = {k: v for k, v in await get_departments(session, limit=limit, start=start, end=end)}
-    first_button_id = list(existing_departments)[0]
-    last_button_id = list(existing_departments)[-1]
-    for department_id, title in existing_departments.items():
-        builder.row(InlineKeyboardButton(
-            text=title.capitalize(),
-            callback_data=MainCallbackFactory(category="departments", action="select", data=department_id).pack()))
 
-    if first_button_id != first_department_id and last_button_id != last_department_id:
+@lru_cache(maxsize=None)
+def make_choice_rows(category: str, choices: tuple[tuple[str, str], ...]) -> Rows:
+    builder = InlineKeyboardBuilder()
+    for data, text in choices:
         builder.row(InlineKeyboardButton(
+            text=text, callback_data=MainCallbackFactory(category=category, data=data).pack()))
+    builder.row(
+        InlineKeyboardButton(text="\U00002B05", callback_data="back"),  # Emoji "arrow_left"
+        InlineKeyboardButton(text="\U0001F3E0", callback_data="home")  # Emoji "house"
+    )
+    return builder_rows(builder)
+
+
+def make_choice_keyboard(category: str, choices: tuple[tuple[str, str], ...]) -> InlineKeyboardMarkup:
+    """  One button per choice of the form's question, `choices` are (data, text) pairs  """
+    return rows_to_markup(make_choice_rows(category, choices))
+
+
+# Build keyboards of the form's categories once at import
+for _category in ("universities", "worked_companies", "trips"):
+    make_confirming_rows(_category)
+
+
+def add_departments_navigation(builder: InlineKeyboardBuilder, page: DepartmentsPage):
+    """  Add previous/next buttons, which carry the first/last department id of the page as cursor  """
+    buttons = []
+    if page.has_prev:
+        buttons.append(InlineKeyboardButton(
             text="\U000023EE",
-            callback_data=MainCallbackFactory(category="departments", action="previous").pack()))
-        builder.add(InlineKeyboardButton(
-            text="\U000023ED",
-            callback_data=MainCallbackFactory(category="departments", action="next").pack()))
-    elif first_button_id == first_department_id and last_button_id != last_department_id:
-        builder.row(InlineKeyboardButton(
+            callback_data=MainCallbackFactory(category="departments", action="previous",
+                                              data=page.departments[0][0]).pack()))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton(
             text="\U000023ED",
-            callback_data=MainCallbackFactory(category="departments", action="next").pack()))
-    elif first_button_id != first_department_id and last_button_id == last_department_id:
+            callback_data=MainCallbackFactory(category="departments", action="next",
+                                              data=page.departments[-1][0]).pack()))
+    if buttons:
+        builder.row(*buttons)
+
+
+# Pages are hashable and contain department ids and titles, so a changed catalogue gives a new cache key
+@lru_cache(maxsize=256)
+def make_departments_rows(page: DepartmentsPage) -> Rows:
+    builder = InlineKeyboardBuilder()
+    for department_id, title in page.departments:
         builder.row(InlineKeyboardButton(
-            text="\U000023EE",
-            callback_data=MainCallbackFactory(category="departments", action="previous").pack()))
+            text=title.capitalize(),
+            callback_data=MainCallbackFactory(category="departments", action="select", data=department_id).pack()))
 
+    add_departments_navigation(builder, page)
     builder.row(
         InlineKeyboardButton(
             text="\U00002B05",
@@ -191,43 +220,110 @@ async def make_departments_keyboard(session: AsyncSession, limit=8, start=1, end
             text="\U0001F3E0",
             callback_data=MainCallbackFactory(category="departments", action="home").pack())  # Emoji "house"
     )
-    return builder.as_markup(), first_button_id, last_button_id
+    return builder_rows(builder)
 
 
-async def make_departments_id_keyboard(session: AsyncSession, limit=10, start=1, end=None) -> Optional[
-    tuple[InlineKeyboardMarkup, int, int]
-]:
-    builder = InlineKeyboardBuilder()
-    all_departments = await get_all_departments(session)
-    try:
-        first_department_id = all_departments[0][0]
-        last_department_id = all_departments[-1][0]
-    except IndexError:
+def make_departments_keyboard(page: DepartmentsPage) -> Optional[InlineKeyboardMarkup]:
+    if not page.departments:
         return
-    existing_departments = {k: v for k, v in await get_departments(session, limit=limit, start=start, end=end)}
-    first_button_id = list(existing_departments)[0]
-    last_button_id = list(existing_departments)[-1]
-    for k in existing_departments:
-        builder.add(InlineKeyboardButton(text=k, callback_data=MainCallbackFactory(
-            category="departments", action="open", data=k).pack()))
+    return rows_to_markup(make_departments_rows(page))
+
+
+@lru_cache(maxsize=256)
+def make_departments_id_rows(page: DepartmentsPage) -> Rows:
+    builder = InlineKeyboardBuilder()
+    for department_id, _ in page.departments:
+        builder.add(InlineKeyboardButton(text=department_id, callback_data=MainCallbackFactory(
+            category="departments", action="open", data=department_id).pack()))
     builder.adjust(5)
-    if first_button_id != first_department_id and last_button_id != last_department_id:
+    add_departments_navigation(builder, page)
+    builder.row(InlineKeyboardButton(
+        text="\U0001F3E0",
+        callback_data=MainCallbackFactory(category="departments", action="home").pack()))
+    return builder_rows(builder)
+
+
+def make_departments_id_keyboard(page: DepartmentsPage) -> Optional[InlineKeyboardMarkup]:
+    if not page.departments:
+        return
+    return rows_to_markup(make_departments_id_rows(page))
+
+
+def make_search_keyboard(forms, offset: int, has_next: bool) -> InlineKeyboardMarkup:
+    """  Found applicants with previous/next buttons, which carry offset of the page  """
+    builder = InlineKeyboardBuilder()
+    for form_id, full_name, _ in forms:
         builder.row(InlineKeyboardButton(
+            text=full_name,
+            callback_data=MainCallbackFactory(category="search", action="select", data=form_id).pack()))
+    buttons = []
+    if offset:
+        buttons.append(InlineKeyboardButton(
             text="\U000023EE",
-            callback_data=MainCallbackFactory(category="departments", action="previous").pack()))
-        builder.add(InlineKeyboardButton(
+            callback_data=MainCallbackFactory(category="search", action="previous", data=offset).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
             text="\U000023ED",
-            callback_data=MainCallbackFactory(category="departments", action="next").pack()))
-    elif first_button_id == first_department_id and last_button_id != last_department_id:
-        builder.row(InlineKeyboardButton(
-            text="\U000023ED",
-            callback_data=MainCallbackFactory(category="departments", action="next").pack()))
-    elif first_button_id != first_department_id and last_button_id == last_department_id:
-        builder.row(InlineKeyboardButton(
-            text="\U000023EE",
-            callback_data=MainCallbackFactory(category="departments", action="previous").pack()))
+            callback_data=MainCallbackFactory(category="search", action="next", data=offset + len(forms)).pack()))
+    if buttons:
+        builder.row(*buttons)
+    return builder.as_markup()
 
+
+FACET_TITLES = {
+    "education": "Ma'lumot",
+    "living_conditions": "Yashash sharoit",
+    "working_style": "Ishlash uslubi",
+    "origin": "Qayerdan bildi",
+    "language_level": "Til darajasi",
+    "department": "Bo'lim",
+    "business_trip": "Xizmat safari",
+    "military_service": "Harbiy xizmat",
+}
+
+FACET_VALUE_TITLES = {
+    "education": {"SECONDARY": "O'rta", "SECONDARY_SPECIAL": "O'rta maxsus", "BACHELOR": "Oliy | Bakalavr",
+                  "MASTER": "Oliy | Magistr"},
+    "living_conditions": {"FLAT": "Dom", "HOUSE": "Hovli"},
+    "working_style": {"COLLECTIVE": "Jamoaviy", "INDIVIDUAL": "Yakka"},
+    "origin": {"FAMILIAR": "Tanish orqali", "TELEGRAM": "Telegram", "INSTAGRAM": "Instagram", "FACEBOOK": "Facebook",
+               "OTHER": "Boshqa"},
+    "business_trip": {"true": "Ha", "false": "Yo'q"},
+    "military_service": {"true": "Ha", "false": "Yo'q"},
+}
+
+
+def make_facets_keyboard(filters: dict, count: int) -> InlineKeyboardMarkup:
+    """  Facets with counts of selected values, results and reset buttons  """
+    builder = InlineKeyboardBuilder()
+    for facet, title in FACET_TITLES.items():
+        selected = len(filters.get(facet, ()))
+        builder.add(InlineKeyboardButton(
+            text=f"{title} ({selected})" if selected else title,
+            callback_data=MainCallbackFactory(category="facets", action="open", data=facet).pack()))
+    builder.adjust(2)
+    builder.row(
+        InlineKeyboardButton(
+            text=f"\U0001F50E {count}",  # Emoji "mag_right"
+            callback_data=MainCallbackFactory(category="facets", action="show").pack()),
+        InlineKeyboardButton(
+            text="\U0001F5D1",  # Emoji "wastebasket"
+            callback_data=MainCallbackFactory(category="facets", action="reset").pack())
+    )
+    return builder.as_markup()
+
+
+def make_facet_values_keyboard(facet: str, filters: dict, counts: dict[str, int],
+                               value_titles: dict[str, str]) -> InlineKeyboardMarkup:
+    """  Values of the facet with live counts, selected values are marked and toggled by pressing again  """
+    builder = InlineKeyboardBuilder()
+    selected = set(filters.get(facet, ()))
+    for value, title in value_titles.items():
+        mark = "\U00002705 " if value in selected else ""  # Emoji "white_check_mark"
+        builder.row(InlineKeyboardButton(
+            text=f"{mark}{title} ({counts.get(value, 0)})",
+            callback_data=MainCallbackFactory(category="facets", action="toggle", data=f"{facet}={value}").pack()))
     builder.row(InlineKeyboardButton(
-        text="\U0001F3E0",
-        callback_data=MainCallbackFactory(category="departments", action="home").pack()))
-    return builder.as_markup(), first_button_id, last_button_id
+        text="\U00002B05",  # Emoji "arrow_left"
+        callback_data=MainCallbackFactory(category="facets", action="open").pack()))
+    return builder.as_markup()
@@ -1,7 +1,34 @@
-from typing import Callable, Awaitable, Dict, Any
+from typing import Callable, Awaitable, Dict, Any, Optional
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.services.metrics import DB_SESSIONS
+
+
+class LazySession:
+    """
+    Proxy of AsyncSession which creates the real session only when a handler uses it,
+    so updates that never touch the database don't take anything from the pool
+    """
+
+    def __init__(self, session_pool: Callable[[], AsyncSession]):
+        self._session_pool = session_pool
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def is_used(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, item):
+        if self._session is None:
+            self._session = self._session_pool()
+        return getattr(self._session, item)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
 
 
 class DbSessionMiddleware(BaseMiddleware):
@@ -15,6 +42,11 @@ class DbSessionMiddleware(BaseMiddleware):
             event: TelegramObject,
             data: Dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
-            data["session"] = session
+        session = LazySession(self.session_pool)
+        data["session"] = session
+        data["session_pool"] = self.session_pool
+        try:
             return await handler(event, data)
+        finally:
+            await session.close()
+            DB_SESSIONS.inc("used" if session.is_used else "not_used")
@@ -0,0 +1,91 @@
+import logging
+from typing import Callable, Awaitable, Dict, Any, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.types import TelegramObject
+
+from tgbot.services.storage import PipelinedRedisStorage
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSM context which keeps state and data of the update in memory.
+    State is taken from `raw_state` which is already loaded by the dispatcher, data is loaded once on first use,
+    and all changes are written back by `flush()` when the handler finishes
+    """
+
+    def __init__(self, context: FSMContext, raw_state: Optional[str]):
+        super().__init__(bot=context.bot, storage=context.storage, key=context.key)
+        self._state = raw_state
+        self._data: Optional[Dict[str, Any]] = None
+        self._state_changed = False
+        self._data_changed = False
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def get_state(self) -> Optional[str]:
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = data.copy()
+        self._data_changed = True
+
+    async def _load_data(self):
+        if self._data is None:
+            self._data = await self.storage.get_data(bot=self.bot, key=self.key)
+
+    async def get_data(self) -> Dict[str, Any]:
+        await self._load_data()
+        return self._data.copy()
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        await self._load_data()
+        self._data.update(kwargs)
+        self._data_changed = True
+        return self._data.copy()
+
+    @property
+    def is_changed(self) -> bool:
+        return self._state_changed or self._data_changed
+
+    async def flush(self):
+        """  Write changed state and data to the storage, Redis storage does it in one transaction  """
+        if not self.is_changed:
+            return
+        data = self._data if self._data_changed else None
+        if isinstance(self.storage, PipelinedRedisStorage):
+            await self.storage.set_record(bot=self.bot, key=self.key, state=self._state, data=data)
+        else:
+            if self._state_changed:
+                await self.storage.set_state(bot=self.bot, key=self.key, state=self._state)
+            if data is not None:
+                await self.storage.set_data(bot=self.bot, key=self.key, data=data)
+        self._state_changed = self._data_changed = False
+
+
+class FSMBufferMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        context: Optional[FSMContext] = data.get("state")
+        if context is None:
+            return await handler(event, data)
+        state = BufferedFSMContext(context, raw_state=data.get("raw_state"))
+        data["state"] = state
+        try:
+            return await handler(event, data)
+        finally:
+            # Changes made before an error are kept, as they would be without buffering
+            is_changed = state.is_changed
+            await state.flush()
+            logging.debug("FSM context of %s is %s", state.key.user_id, "flushed" if is_changed else "not changed")
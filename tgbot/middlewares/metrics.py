@@ -0,0 +1,51 @@
+import time
+from typing import Callable, Awaitable, Dict, Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from tgbot.services.metrics import UpdateMetrics, current_update
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Update outer middleware which measures the whole handling of an update: reading its FSM state, filters,
+    inner middlewares and the handler. It must run before the dispatcher's FSM middleware, which loads the state.
+    Database, Bot API and FSM storage hooks add their time to the update through a context variable
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        update = UpdateMetrics()
+        token = current_update.set(update)
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            # The FSM middleware puts the state, which the update was handled in, to the same data
+            update.state = data.get("raw_state") or "none"
+            update.observe(time.perf_counter() - started_at)
+            current_update.reset(token)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware which labels the current update with the router and handler that took it,
+    outer middlewares run before the handler is found and can't see them
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        update = current_update.get()
+        if update is not None:
+            update.router = data["event_router"].name
+            update.handler = data["handler"].callback.__name__
+        return await handler(event, data)
@@ -0,0 +1,21 @@
+from typing import Callable, Awaitable, Dict, Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from tgbot.database.functions.profiler import query_profiler
+
+
+class QueryProfilerMiddleware(BaseMiddleware):
+    """  Inner middleware which lets the query profiler group statements by the update and handler  """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        if not query_profiler.enabled:
+            return await handler(event, data)
+        with query_profiler.track_update(data["handler"].callback.__name__):
+            return await handler(event, data)
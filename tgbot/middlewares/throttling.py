@@ -0,0 +1,55 @@
+import logging
+from typing import Callable, Awaitable, Dict, Any, Optional, Union
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, CallbackQuery
+
+from tgbot.services.metrics import THROTTLED_UPDATES
+from tgbot.services.throttling import Limit, MemoryLimiter, RedisLimiter
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Inner middleware which limits updates of every user with token buckets, registered before other
+    inner middlewares, so a rejected update gets neither a database session nor the handler.
+    The limit is chosen by the FSM state, then by the router which took the update, then the default one
+    """
+
+    def __init__(self, limiter: Union[MemoryLimiter, RedisLimiter], default_limit: Limit,
+                 router_limits: Optional[Dict[str, Limit]] = None, state_limits: Optional[Dict[str, Limit]] = None):
+        super().__init__()
+        self.limiter = limiter
+        self.default_limit = default_limit
+        self.router_limits = router_limits or {}
+        self.state_limits = state_limits or {}
+
+    def get_limit(self, data: Dict[str, Any]) -> tuple[str, Limit]:
+        """  :return: (scope which has its own bucket, limit)  """
+        state = data.get("raw_state")
+        if state in self.state_limits:
+            return state, self.state_limits[state]
+        router = data["event_router"].name
+        if router in self.router_limits:
+            return router, self.router_limits[router]
+        return "default", self.default_limit
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        scope, limit = self.get_limit(data)
+        if await self.limiter.consume(f"{user.id}:{scope}", limit):
+            return await handler(event, data)
+        THROTTLED_UPDATES.inc(scope)
+        logging.debug("Update of %s is throttled in %s", user.id, scope)
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer()  # Stop the button's loading animation, messages are just ignored
+            except TelegramAPIError:
+                pass
@@ -50,4 +50,10 @@ class NewUserStates(StatesGroup):
     q21_other_app = State()
     q22_origin = State()
     q23_photo = State()
-    ready_form = State()
\ No newline at end of file
+    ready_form = State()
+    business_trip = State()
+    salary_last_job = State()
+    overwork_agreement = State()
+    force_majeure_salary_agreement = State()
+    working_style = State()
+    health = State()
\ No newline at end of file
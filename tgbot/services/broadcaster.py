@@ -1,39 +1,201 @@
 import asyncio
+import enum
 import logging
+import time
+import uuid
+from typing import Callable, Coroutine, Iterable, Optional
 
 from aiogram import Bot
 from aiogram import exceptions
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from tgbot.database.functions.broadcasts import (get_recipients, get_unfinished_broadcast_jobs, claim_broadcast_job,
+                                                 save_broadcast_progress, finish_broadcast_job)
+
+GLOBAL_RATE = 30  # Telegram limit: 30 messages per second
+CHAT_RATE = 1  # Telegram limit: 1 message per second to the same chat
+WORKERS = 10
+MAX_RETRIES = 3
+BATCH_SIZE = 100
+LEASE_TIMEOUT = 120  # Seconds without checkpoints after which a running job is taken over by another replica
+
+running_jobs: set[int] = set()  # Jobs run by this process
+background_tasks: set[asyncio.Task] = set()
+CHATS_KEPT = 10000  # Sending times of chats kept by a limiter before the expired ones are dropped
+
+
+class SendStatus(enum.Enum):
+    SUCCESS = "SUCCESS"
+    FORBIDDEN = "FORBIDDEN"
+    FAILED = "FAILED"
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all senders with an additional per-chat interval.
+    When Telegram answers with RetryAfter the whole limiter is paused, not only one sender
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.chat_interval = 1 / chat_rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.chats_sent_at: dict[int, float] = {}
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                chat_ready_at = self.chats_sent_at.get(chat_id, 0.0) + self.chat_interval
+                wait = max(self.paused_until - now, chat_ready_at - now, (1 - self.tokens) / self.rate, 0)
+                if not wait:
+                    self.tokens -= 1
+                    self.chats_sent_at[chat_id] = now
+                    if len(self.chats_sent_at) > CHATS_KEPT:
+                        self.chats_sent_at = {chat: sent_at for chat, sent_at in self.chats_sent_at.items()
+                                              if sent_at + self.chat_interval > now}
+                    return
+            await asyncio.sleep(wait)
+
+
+limiters: dict[int, RateLimiter] = {}  # Telegram limits are per bot, so all broadcasts of a bot share a limiter
+
+
+def get_limiter(bot: Bot) -> RateLimiter:
+    if bot.id not in limiters:
+        limiters[bot.id] = RateLimiter()
+    return limiters[bot.id]
+
+
+async def send_message(bot: Bot, user_id, text: str, disable_notification: bool = False,
+                       limiter: Optional[RateLimiter] = None, retries: int = MAX_RETRIES) -> SendStatus:
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire(user_id)
+        try:
+            await bot.send_message(user_id, text, disable_notification=disable_notification)
+        except exceptions.TelegramForbiddenError:
+            logging.error(f"Target [ID:{user_id}]: got TelegramForbiddenError")
+            return SendStatus.FORBIDDEN
+        except exceptions.TelegramRetryAfter as e:
+            logging.error(f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds.")
+            if limiter:
+                limiter.pause(e.retry_after)
+            else:
+                await asyncio.sleep(e.retry_after)
+        except exceptions.TelegramAPIError:
+            logging.exception(f"Target [ID:{user_id}]: failed")
+            return SendStatus.FAILED
+        else:
+            logging.info(f"Target [ID:{user_id}]: success")
+            return SendStatus.SUCCESS
+    logging.error(f"Target [ID:{user_id}]: failed after {retries} retries")
+    return SendStatus.FAILED
+
+
+async def broadcast(bot: Bot, users: Iterable[int], text, disable_notification: bool = False,
+                    workers: int = WORKERS, limiter: Optional[RateLimiter] = None) -> dict[int, SendStatus]:
+    """
+    Concurrent broadcaster bounded by Telegram rate limits
+    :return: Sending status of every recipient
+    """
+    limiter = limiter or get_limiter(bot)
+    queue = asyncio.Queue()
+    for user_id in users:
+        queue.put_nowait(user_id)
+    results = {}
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            results[user_id] = await send_message(bot, user_id, text, disable_notification=disable_notification,
+                                                  limiter=limiter)
 
-async def send_message(bot: Bot, user_id, text: str, disable_notification: bool = False) -> bool:
-    try:
-        await bot.send_message(user_id, text, disable_notification=disable_notification)
-    except exceptions.TelegramForbiddenError:
-        logging.error(f"Target [ID:{user_id}]: got TelegramForbiddenError")
-    except exceptions.TelegramRetryAfter as e:
-        logging.error(f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds.")
-        await asyncio.sleep(e.retry_after)
-        return await send_message(bot, user_id, text)  # Recursive call
-    except exceptions.TelegramAPIError:
-        logging.exception(f"Target [ID:{user_id}]: failed")
-    else:
-        logging.info(f"Target [ID:{user_id}]: success")
-        return True
-    return False
-
-
-async def broadcast(bot, users, text) -> int:
-    """
-    Simple broadcaster
-    :return: Count of messages
-    """
-    count = 0
     try:
-        for user_id in users:
-            if await send_message(bot, user_id, text):
-                count += 1
-            await asyncio.sleep(0.05)  # 20 messages per second (Limit: 30 messages per second)
+        await asyncio.gather(*(worker() for _ in range(min(workers, queue.qsize()))))
     finally:
+        count = sum(status == SendStatus.SUCCESS for status in results.values())
         logging.info(f"{count} messages successful sent.")
 
-    return count
+    return results
+
+
+def forget_task(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background task {task.get_name()} failed", exc_info=task.exception())
+
+
+def run_in_background(coroutine: Coroutine, name: str) -> asyncio.Task:
+    """  Start a task which isn't awaited, it is referenced until it is done and its failure is logged  """
+    task = asyncio.create_task(coroutine, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(forget_task)
+    return task
+
+
+async def run_broadcast_job(bot: Bot, session_pool: Callable[[], AsyncSession], job_id: int,
+                            batch_size: int = BATCH_SIZE):
+    """
+    Send a persisted broadcast job batch by batch.
+    Progress is checkpointed after every batch, so the job continues from there after restart.
+    The job is claimed in the database first, so replicas of the bot don't send it twice
+    """
+    if job_id in running_jobs:
+        return
+    running_jobs.add(job_id)
+    owner = uuid.uuid4().hex
+    try:
+        async with session_pool() as session:
+            job = await claim_broadcast_job(session, job_id, owner=owner, lease=LEASE_TIMEOUT)
+        if job is None:
+            return  # Finished, or run by another replica
+        text, last_user_id = job.text, job.last_user_id
+        while True:
+            async with session_pool() as session:
+                recipients = await get_recipients(session, after_id=last_user_id, limit=batch_size)
+            if not recipients:
+                break
+            results = await broadcast(bot, recipients, text)
+            sent = sum(status == SendStatus.SUCCESS for status in results.values())
+            last_user_id = recipients[-1]
+            async with session_pool() as session:
+                if not await save_broadcast_progress(session, job_id, owner=owner, last_user_id=last_user_id,
+                                                     sent=sent, failed=len(results) - sent):
+                    logging.warning(f"Broadcast job [ID:{job_id}] was taken over by another replica")
+                    return
+        async with session_pool() as session:
+            await finish_broadcast_job(session, job_id, owner=owner)
+        logging.info(f"Broadcast job [ID:{job_id}] is finished")
+    finally:
+        running_jobs.discard(job_id)
+
+
+def start_broadcast_job(bot: Bot, session_pool: Callable[[], AsyncSession], job_id: int) -> asyncio.Task:
+    return run_in_background(run_broadcast_job(bot, session_pool, job_id), name=f"broadcast-{job_id}")
+
+
+async def resume_broadcast_jobs(bot: Bot, session_pool: Callable[[], AsyncSession], interval: float = LEASE_TIMEOUT):
+    """
+    Start unfinished jobs now and then. Jobs interrupted by restart, or left by a stopped replica,
+    are claimed again when their lease expires
+    """
+    while True:
+        try:
+            async with session_pool() as session:
+                job_ids = await get_unfinished_broadcast_jobs(session)
+            for job_id in job_ids:
+                if job_id not in running_jobs:
+                    start_broadcast_job(bot, session_pool, job_id)
+        except Exception:
+            logging.exception("Unfinished broadcast jobs are not resumed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update, CallbackQuery
+from aiogram.types.update import UpdateTypeLookupError
+
+
+def get_chat_id(update: Update) -> Optional[int]:
+    """  Chat of the update, or its user for updates which have no chat  """
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return
+    if isinstance(event, CallbackQuery):
+        return event.message.chat.id if event.message else event.from_user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user else None
+
+
+def get_press(update: Update) -> Optional[tuple[int, str]]:
+    """  Message and data of a pressed inline button, presses of the same button are equal  """
+    callback = update.callback_query
+    if callback is None or callback.message is None:
+        return
+    return callback.message.message_id, callback.data
+
+
+class ChatQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.size = 0  # Updates waiting for the lock or holding it
+        self.presses: set[tuple[int, str]] = set()
+
+
+class SerializedDispatcher(Dispatcher):
+    """
+    Dispatcher which handles updates of one chat one by one in order of arrival, while different chats
+    are handled in parallel. Concurrent updates of one chat would read the same FSM state and data
+    and overwrite each other's changes.
+    A press of a button which is already waiting or being handled is dropped, so are updates over the limit
+    of the chat's queue, so one chat can't take all the webhook's slots of concurrent updates
+    """
+
+    def __init__(self, *args: Any, max_chat_queue: int = 10, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.max_chat_queue = max_chat_queue
+        self.chat_queues: dict[int, ChatQueue] = {}
+        self.dropped_updates = 0
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        chat_id = get_chat_id(update)
+        if chat_id is None:
+            return await super().feed_update(bot, update, **kwargs)
+        queue = self.chat_queues.get(chat_id)
+        if queue is None:
+            queue = self.chat_queues[chat_id] = ChatQueue()
+        press = get_press(update)
+        if queue.size >= self.max_chat_queue or press in queue.presses:
+            await self.drop_update(bot, update)
+            return
+        queue.size += 1
+        if press is not None:
+            queue.presses.add(press)
+        try:
+            # Serialized before the FSM middleware reads the state, so every update sees changes of the previous one
+            async with queue.lock:
+                return await super().feed_update(bot, update, **kwargs)
+        finally:
+            queue.size -= 1
+            queue.presses.discard(press)
+            if not queue.size:
+                del self.chat_queues[chat_id]
+
+    async def drop_update(self, bot: Bot, update: Update):
+        self.dropped_updates += 1
+        logging.debug("Update %s is dropped, %d updates are dropped", update.update_id, self.dropped_updates)
+        if update.callback_query is not None:
+            try:
+                await bot.answer_callback_query(update.callback_query.id)  # Stop the button's loading animation
+            except TelegramAPIError:
+                pass
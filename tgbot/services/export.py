@@ -0,0 +1,49 @@
+import asyncio
+import csv
+import enum
+from typing import Iterable
+
+from openpyxl import Workbook
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.functions.forms import stream_forms_export
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+
+def make_cells(row: Iterable) -> list:
+    return [value.value if isinstance(value, enum.Enum) else value for value in row]
+
+
+def append_rows(sheet, rows: list):
+    for row in rows:
+        sheet.append(make_cells(row))
+
+
+async def export_forms(session: AsyncSession, path: str, file_format="csv") -> int:
+    """
+    Write all forms to CSV or XLSX file batch by batch, so memory usage doesn't depend on count of forms.
+    Batches are read from the database on the event loop and written to the file in a thread,
+    so building a large workbook doesn't stop handling of other updates
+    :return: count of exported forms
+    """
+    count = 0
+    batches = stream_forms_export(session)
+    if file_format == "xlsx":
+        workbook = Workbook(write_only=True)  # Rows are flushed to a temporary file instead of being kept in memory
+        sheet = workbook.create_sheet("Anketalar")
+        async for rows in batches:
+            if not count:
+                sheet.append(list(rows[0].keys()))
+            await asyncio.to_thread(append_rows, sheet, rows)
+            count += len(rows)
+        await asyncio.to_thread(workbook.save, path)
+    else:
+        with open(path, "w", encoding="utf-8-sig", newline="") as file:
+            writer = csv.writer(file)
+            async for rows in batches:
+                if not count:
+                    writer.writerow(rows[0].keys())
+                await asyncio.to_thread(writer.writerows, [make_cells(row) for row in rows])
+                count += len(rows)
+    return count
@@ -0,0 +1,126 @@
+import zlib
+from html import escape
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+
+FORM_FIELDS = (
+    ("full_name", "Ism va Familiya"),
+    ("birthday", "Tug'ilgan sana"),
+    ("phonenum", "Telefon raqam"),
+    ("department", "Bo'lim"),
+    ("address", "Yashash manzil"),
+    ("living_conditions", "Yashsh sharoit"),
+    ("education", "Ma'lumot"),
+    ("marital_status", "Oilaviy ahvol"),
+    ("business_trip", "Xizmat safarlari"),
+    ("military_service", "Harbiy xizmat"),
+    ("criminal_record", "Sudlanganlik"),
+    ("driver_license", "Haydovchilik guvohnomasi"),
+    ("personal_car", "Shaxsiy avtomobil"),
+    ("russian", "Rus tili"),
+    ("english", "Ingliz tili"),
+    ("chinese", "Xitoy tili"),
+    ("word", "Word"),
+    ("excel", "Excel"),
+    ("1c", "1C"),
+    ("origin", "Biz haqimizda"),
+    ("salary_last_job", "Oxirgi maosh"),
+    ("overwork_agreement", "Qo'shimcha ish soatlari"),
+    ("force_majeure_salary_agreement", "Fors-major holatda maosh"),
+    ("working_style", "Ishlash uslubi"),
+    ("health", "Sog'lig'i"),
+)
+
+FORM_LISTS = (
+    ("universities", "O'quv yurti",
+     (("name", "Nomi"), ("direction", "Yo'nalishi"), ("finished_year", "Tamomlagan yili"))),
+    ("companies", "Sobiq korxona",
+     (("name", "Nomi"), ("position", "Lavozimi"), ("working_period", "Ishlash davri"),
+      ("leaving_reason", "Ketish sababi"))),
+    ("trips", "Sayohat",
+     (("country", "Davlat"), ("reason", "Sabab"), ("period", "Sana"))),
+)
+
+YES_NO = {"yes": "Ha", "no": "Yo'q"}
+LEVELS = {"0": "Bilmayman", "1": "Boshlang'ich", "2": "O'rta", "3": "Yuqori"}
+
+FORM_CHOICES = {
+    "living_conditions": {"flat": "Dom", "house": "Hovli"},
+    "education": {"secondary": "O'rta", "secondary_special": "O'rta maxsus", "bachelor": "Oliy | Bakalavr",
+                  "master": "Oliy | Magistr"},
+    "marital_status": {"married": "Turmush qurgan", "not_married": "Turmush qurmagan"},
+    "business_trip": YES_NO,
+    "military_service": YES_NO,
+    "russian": LEVELS,
+    "english": LEVELS,
+    "chinese": LEVELS,
+    "word": LEVELS,
+    "excel": LEVELS,
+    "1c": LEVELS,
+    "origin": {"familiar": "Tanishlar orqali", "telegram": "Telegram", "instagram": "Instagram",
+               "facebook": "Facebook", "other": "Boshqa"},
+    "overwork_agreement": YES_NO,
+    "force_majeure_salary_agreement": YES_NO,
+    "working_style": {"collective": "Jamoada", "individual": "Yakka tartibda"},
+}
+
+
+def render_form_text(form: dict) -> str:
+    """
+    Render answers of the form, which are kept in FSM data as a plain dict, e.g.
+    {"full_name": "...", "education": "master", "universities": [{"name": "...", "direction": "..."}]}
+    Answers are typed by users, so they are escaped for HTML parse mode
+    """
+    text = ""
+    for field, title in FORM_FIELDS:
+        if field in form:
+            value = FORM_CHOICES.get(field, {}).get(form[field], form[field])
+            text += f"<b>{title}:</b> {escape(str(value))}\n"
+    for field, title, item_fields in FORM_LISTS:
+        if field not in form:
+            continue
+        if not form[field]:
+            text += f"<b>{title}: </b>\U00002796\n"  # Emoji 'heavy_minus_sign'
+            continue
+        text += f"<b>{title}: </b>"
+        for item in form[field]:
+            text += "\n"
+            for item_field, item_title in item_fields:
+                if item_field in item:
+                    text += f"    <b>{item_title}:</b> {escape(str(item[item_field]))}\n"
+    return text
+
+
+def render_form_message(form: dict, question: str) -> str:
+    """  Form's answers and the current question are shown in one message  """
+    form_text = render_form_text(form)
+    if form_text:
+        return f"{form_text}\n{question}"
+    return question
+
+
+def get_render_hash(text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> int:
+    markup = reply_markup.json() if reply_markup else ""
+    return zlib.crc32(f"{text}\x00{markup}".encode())
+
+
+async def edit_form_message(bot: Bot, chat_id: int, message_id: int, form: dict, question: str,
+                            reply_markup: Optional[InlineKeyboardMarkup] = None,
+                            last_hash: Optional[int] = None) -> int:
+    """
+    Update the form message with a single Bot API call, or without any call if nothing has changed
+    :return: Hash of the rendered message, it should be saved as "form_hash" in FSM data
+    """
+    text = render_form_message(form, question)
+    render_hash = get_render_hash(text, reply_markup)
+    if render_hash != last_hash:
+        try:
+            await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                raise
+    return render_hash
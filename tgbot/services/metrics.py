@@ -0,0 +1,239 @@
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.methods import TelegramMethod, Response
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50)
+
+
+def format_labels(labelnames: tuple[str, ...], labels: tuple, **extra: str) -> str:
+    pairs = [*zip(labelnames, labels), *extra.items()]
+    if not pairs:
+        return ""
+    values = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(pairs, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Prometheus histogram. Quantiles are also estimated here the same way as histogram_quantile() does,
+    so they can be read from the endpoint without a Prometheus server
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = TIME_BUCKETS, quantiles: tuple[float, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.quantiles = quantiles
+        self.series: dict[tuple, list] = {}  # Labels -> [count of each bucket and +Inf, sum]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def quantile(self, q: float, labels: tuple) -> float:
+        counts = self.series[labels][:-1]
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # Values over the last bucket can't be estimated
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bucket, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le=str(bucket))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+        if not self.quantiles:
+            return
+        yield f"# HELP {self.name}_quantile Quantiles of {self.name} estimated from its buckets"
+        yield f"# TYPE {self.name}_quantile gauge"
+        for labels in self.series:
+            for q in self.quantiles:
+                yield f"{self.name}_quantile{format_labels(self.labelnames, labels, quantile=str(q))} " \
+                      f"{self.quantile(q, labels)}"
+
+
+UPDATE_LABELS = ("router", "handler", "state")
+
+UPDATE_DURATION = Histogram("tgbot_update_duration_seconds", "Wall time of handling an update",
+                            UPDATE_LABELS, quantiles=(0.5, 0.95, 0.99))
+UPDATE_DB_DURATION = Histogram("tgbot_update_db_seconds", "Time spent in database queries per update",
+                               UPDATE_LABELS, quantiles=(0.5, 0.95, 0.99))
+UPDATE_STORAGE_DURATION = Histogram("tgbot_update_storage_seconds", "Time spent in FSM storage per update",
+                                    UPDATE_LABELS, quantiles=(0.5, 0.95, 0.99))
+UPDATE_API_CALLS = Histogram("tgbot_update_api_calls", "Count of Bot API calls per update",
+                             UPDATE_LABELS, buckets=COUNT_BUCKETS)
+UPDATE_API_DURATION = Histogram("tgbot_update_api_seconds", "Time spent in Bot API calls per update",
+                                UPDATE_LABELS, quantiles=(0.5, 0.95, 0.99))
+API_REQUEST_DURATION = Histogram("tgbot_api_request_duration_seconds", "Latency of Bot API requests", ("method",),
+                                 quantiles=(0.5, 0.95, 0.99))
+API_REQUEST_ERRORS = Counter("tgbot_api_request_errors_total", "Failed Bot API requests", ("method", "error"))
+DB_QUERY_DURATION = Histogram("tgbot_db_query_duration_seconds", "Latency of database queries")
+THROTTLED_UPDATES = Counter("tgbot_throttled_updates_total", "Updates rejected by the throttling", ("scope",))
+DB_SESSIONS = Counter("tgbot_db_sessions_total", "Handled updates by whether they needed a database session",
+                      ("session",))
+
+METRICS = (UPDATE_DURATION, UPDATE_DB_DURATION, UPDATE_STORAGE_DURATION, UPDATE_API_CALLS, UPDATE_API_DURATION,
+           API_REQUEST_DURATION, API_REQUEST_ERRORS, DB_QUERY_DURATION, THROTTLED_UPDATES, DB_SESSIONS)
+
+
+@dataclass
+class UpdateMetrics:
+    """  Measurements of the update being handled, collected from the database, Bot API and FSM storage hooks  """
+    router: str = "none"
+    handler: str = "none"
+    state: str = "none"
+    db_time: float = 0.0
+    db_queries: int = 0
+    storage_time: float = 0.0
+    api_calls: int = 0
+    api_time: float = 0.0
+
+    def observe(self, duration: float):
+        labels = (self.router, self.handler, self.state)
+        UPDATE_DURATION.observe(duration, *labels)
+        UPDATE_DB_DURATION.observe(self.db_time, *labels)
+        UPDATE_STORAGE_DURATION.observe(self.storage_time, *labels)
+        UPDATE_API_CALLS.observe(self.api_calls, *labels)
+        UPDATE_API_DURATION.observe(self.api_time, *labels)
+
+
+current_update: ContextVar[Optional[UpdateMetrics]] = ContextVar("current_update", default=None)
+
+
+@contextmanager
+def measure_storage():
+    """  Add time of FSM storage calls inside the block to the current update  """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        update = current_update.get()
+        if update is not None:
+            update.storage_time += time.perf_counter() - started_at
+
+
+def instrument_storage(storage: BaseStorage):
+    """  Time every call of the FSM storage, the dispatcher reading the state too, and add it to the current update  """
+
+    def measure(method):
+        @functools.wraps(method)
+        async def measured(*args, **kwargs):
+            with measure_storage():
+                return await method(*args, **kwargs)
+
+        return measured
+
+    for name in ("get_state", "set_state", "get_data", "set_data", "update_data", "set_record"):
+        if hasattr(storage, name):
+            setattr(storage, name, measure(getattr(storage, name)))
+
+
+def instrument_engine(engine: AsyncEngine):
+    """  Time every statement executed by the engine and add it to the current update  """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started_at"].pop()
+        DB_QUERY_DURATION.observe(elapsed)
+        update = current_update.get()
+        if update is not None:
+            update.db_time += elapsed
+            update.db_queries += 1
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(exception_context):
+        started_at = exception_context.connection.info.get("metrics_started_at") \
+            if exception_context.connection is not None else None
+        if started_at:
+            started_at.pop()
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """  Bot session middleware which measures latency of Bot API requests  """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                       method: TelegramMethod) -> Response:
+        method_name = type(method).__name__
+        started_at = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_REQUEST_ERRORS.inc(method_name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started_at
+            API_REQUEST_DURATION.observe(elapsed, method_name)
+            update = current_update.get()
+            if update is not None:
+                update.api_calls += 1
+                update.api_time += elapsed
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """  Serve metrics in Prometheus text format on http://host:port/metrics  """
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info(f"Metrics are served on {host}:{port}/metrics")
+    return runner
@@ -0,0 +1,85 @@
+import csv
+import io
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Iterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tgbot.database.functions.payroll import copy_payroll_records
+from tgbot.database.models.models import Salaries, Fines, Bonuses
+
+MAX_REPORTED_ERRORS = 20
+
+# Import kind -> (table, required CSV columns, columns of copied records)
+PAYROLL_IMPORTS = {
+    "salaries": (Salaries, ("user_id", "amount"), ("user_id", "assigner_id", "amount", "given_at")),
+    "fines": (Fines, ("user_id", "amount"), ("user_id", "assigner_id", "amount", "given_at")),
+    "bonuses": (Bonuses, ("user_id", "amount", "title"), ("user_id", "assigner_id", "amount", "title", "description")),
+}
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    failed: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)  # First errors as (line, reason)
+
+    def add_error(self, line: int, reason: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+
+def parse_record(kind: str, row: dict, assigner_id: int, now: datetime) -> tuple:
+    """
+    Validate a CSV row and convert it to a record for COPY, existence of the user is checked by the database
+    :raise ValueError: with the reason if the row is invalid
+    """
+    user_id = int(row["user_id"])
+    amount = int(row["amount"])
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    if kind == "bonuses":
+        title = (row["title"] or "").strip()
+        if not title or len(title) > 255:
+            raise ValueError("title must be 1-255 characters long")
+        return user_id, assigner_id, amount, title, row.get("description") or None
+    given_at = datetime.fromisoformat(row["given_at"]) if row.get("given_at") else now
+    return user_id, assigner_id, amount, given_at
+
+
+def read_records(kind: str, reader: csv.DictReader, result: ImportResult, assigner_id: int) -> Iterator[tuple]:
+    """  Yield valid records with their line numbers one by one, invalid rows are counted in the result and skipped  """
+    now = datetime.now()
+    for row in reader:
+        try:
+            yield reader.line_num, *parse_record(kind, row, assigner_id, now)
+        except (ValueError, TypeError) as e:
+            result.add_error(reader.line_num, str(e))
+
+
+async def import_payroll_csv(session: AsyncSession, kind: str, file: BinaryIO, assigner_id: int) -> ImportResult:
+    """
+    Import salaries, fines or bonuses from a CSV file with a header row.
+    The file is read row by row while it's copied to database, so memory usage doesn't depend on its size
+    :raise ValueError: if the kind is unknown or required columns are missing
+    """
+    if kind not in PAYROLL_IMPORTS:
+        raise ValueError(f"Unknown import: {kind}")
+    table, required_columns, columns = PAYROLL_IMPORTS[kind]
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    missing_columns = set(required_columns) - set(reader.fieldnames or ())
+    if missing_columns:
+        raise ValueError(f"Missing columns: {', '.join(sorted(missing_columns))}")
+
+    result = ImportResult()
+    copied = await copy_payroll_records(session, table, list(columns),
+                                        read_records(kind, reader, result, assigner_id),
+                                        max_rejected_lines=MAX_REPORTED_ERRORS)
+    result.imported = copied.imported
+    for line, user_id in copied.rejected_lines:
+        result.add_error(line, f"user {user_id} doesn't exist")
+    result.failed += copied.rejected - len(copied.rejected_lines)
+    result.errors.sort()
+    return result
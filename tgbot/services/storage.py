@@ -0,0 +1,73 @@
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+from redis.asyncio.client import Redis
+from redis.asyncio.connection import ConnectionPool
+from redis.exceptions import WatchError
+
+from tgbot.config import Config, RedisConfig
+
+
+class PipelinedRedisStorage(RedisStorage):
+    """
+    Redis FSM storage which reads and writes the data record in a single transaction,
+    so concurrent replicas can't overwrite each other's half-filled forms
+    """
+
+    async def update_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        redis_key = self.key_builder.build(key, "data")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(redis_key)
+                    value = await pipe.get(redis_key)
+                    if isinstance(value, bytes):
+                        value = value.decode("utf-8")
+                    current_data = bot.session.json_loads(value) if value else {}
+                    current_data.update(data)
+                    pipe.multi()
+                    if current_data:
+                        pipe.set(redis_key, bot.session.json_dumps(current_data), ex=self.data_ttl)
+                    else:
+                        pipe.delete(redis_key)
+                    await pipe.execute()
+                    return current_data.copy()
+                except WatchError:
+                    continue  # The record was changed by another replica, read it again
+
+    async def set_record(self, bot: Bot, key: StorageKey, state: StateType = None,
+                         data: Optional[Dict[str, Any]] = None) -> None:
+        """  Write state and data in one MULTI/EXEC round trip, `data=None` leaves the data record untouched  """
+        state_key = self.key_builder.build(key, "state")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, state.state if isinstance(state, State) else state, ex=self.state_ttl)
+            if data is not None:
+                data_key = self.key_builder.build(key, "data")
+                if data:
+                    pipe.set(data_key, bot.session.json_dumps(data), ex=self.data_ttl)
+                else:
+                    pipe.delete(data_key)
+            await pipe.execute()
+
+
+def create_redis_storage(redis_config: RedisConfig) -> PipelinedRedisStorage:
+    """  Create a Redis storage with its own connection pool  """
+    pool = ConnectionPool.from_url(redis_config.construct_redis_url(), max_connections=redis_config.max_connections)
+    return PipelinedRedisStorage(redis=Redis(connection_pool=pool),
+                                 key_builder=DefaultKeyBuilder(with_bot_id=True),
+                                 state_ttl=redis_config.state_ttl,
+                                 data_ttl=redis_config.data_ttl)
+
+
+def create_storage(config: Config) -> BaseStorage:
+    """  Choose FSM storage by USE_REDIS flag  """
+    if config.tg_bot.use_redis:
+        return create_redis_storage(config.redis)
+    return MemoryStorage()
@@ -0,0 +1,76 @@
+import time
+from dataclasses import dataclass
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio.client import Redis
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float  # Updates per second refilled to the bucket
+    burst: int  # Size of the bucket, updates which can come at once
+
+
+class MemoryLimiter:
+    """  Token buckets of this process, enough for a single replica  """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.buckets: dict[str, list[float]] = {}  # Key -> [tokens, updated_at]
+
+    async def consume(self, key: str, limit: Limit) -> bool:
+        """  :return: whether the bucket had a token for the update  """
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.maxsize:
+                self.purge(now)
+            bucket = self.buckets[key] = [limit.burst, now]
+        tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+        allowed = tokens >= 1
+        bucket[0], bucket[1] = tokens - allowed, now
+        return allowed
+
+    def purge(self, now: float):
+        """  Forget buckets idle for a minute, they would be full again anyway  """
+        for key, bucket in list(self.buckets.items()):
+            if now - bucket[1] > 60:
+                del self.buckets[key]
+        if len(self.buckets) >= self.maxsize:
+            del self.buckets[next(iter(self.buckets))]
+
+
+# Refill and take a token in one atomic step, so all replicas share the bucket
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+tokens = math.min(burst, tokens + math.max(now - (tonumber(bucket[2]) or now), 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return allowed
+"""
+
+
+class RedisLimiter:
+    """  Token buckets in Redis, shared by all replicas of the bot  """
+
+    def __init__(self, redis: Redis, prefix: str = "throttling"):
+        self.prefix = prefix
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def consume(self, key: str, limit: Limit) -> bool:
+        return bool(await self.script(keys=[f"{self.prefix}:{key}"], args=[limit.rate, limit.burst, time.time()]))
+
+
+def create_limiter(storage: BaseStorage):
+    """  Buckets are kept next to FSM states, in Redis when the bot is run with it  """
+    if isinstance(storage, RedisStorage):
+        return RedisLimiter(storage.redis)
+    return MemoryLimiter()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from tgbot.config import Webhook
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook request handler which checks the secret token and limits count of updates
+    processed at the same time, the rest of requests wait before Telegram gets the response
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret: str = None, max_concurrent_updates: int = 100,
+                 **data: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **data)
+        self.secret = secret
+        self.semaphore = asyncio.Semaphore(max_concurrent_updates)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot=bot, update=update)
+        finally:
+            self.semaphore.release()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_TOKEN_HEADER) != self.secret:
+            raise web.HTTPUnauthorized()
+        await self.semaphore.acquire()
+        try:
+            return await super().handle(request)
+        except Exception:
+            self.semaphore.release()
+            raise
+
+    __call__ = handle
+
+
+async def start_webhook(dp: Dispatcher, bot: Bot, webhook: Webhook, **data: Any):
+    """  Set the webhook and serve updates with aiohttp until the task is cancelled  """
+    app = web.Application()
+    BoundedRequestHandler(dispatcher=dp, bot=bot, secret=webhook.secret,
+                          max_concurrent_updates=webhook.max_concurrent_updates,
+                          **data).register(app, path=webhook.path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=webhook.app_host, port=webhook.app_port)
+    await site.start()
+    await bot.set_webhook(url=webhook.construct_webhook_url(), secret_token=webhook.secret or None,
+                          max_connections=webhook.max_connections,
+                          allowed_updates=dp.resolve_used_update_types())
+    logging.info(f"Webhook is listening on {webhook.app_host}:{webhook.app_port}{webhook.path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()